@@ -1,3 +1,25 @@
 from django.contrib import admin
+from .models import Profile, UserShard
 
-# Register your models here.
+
+@admin.register(Profile)
+class ProfileAdmin(admin.ModelAdmin):
+    list_display = ('user', 'base_currency', 'created_at')
+    list_filter = ('base_currency',)
+    list_select_related = ('user',)
+    search_fields = ('user__username',)
+    autocomplete_fields = ('user',)
+    readonly_fields = ('created_at', 'updated_at')
+
+
+@admin.register(UserShard)
+class UserShardAdmin(admin.ModelAdmin):
+    list_display = ('user', 'database', 'moving', 'updated_at')
+    list_filter = ('database', 'moving')
+    list_select_related = ('user',)
+    search_fields = ('user__username',)
+    readonly_fields = ('user', 'database', 'moving', 'updated_at')
+
+    def has_add_permission(self, request):
+        # Users are placed on signup and moved with `manage.py move_user_shard`
+        return False
@@ -0,0 +1,140 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from accounts.models import UserShard
+from accounts.sharding import lock_user, mirror_user, shard_for_user, use_shard
+from api.models import Budget, Category, DailyBalance, RecurringRule, SavingsGoal, Tag, Transaction
+from api.signals import balance_updates_suspended, sync_tag_ids
+from api.versions import touch, user_key
+
+
+TransactionTag = Transaction.tags.through
+RuleTag = RecurringRule.tags.through
+
+
+class Command(BaseCommand):
+    help = (
+        "Move a user's data to another shard. API requests for the user get "
+        "503 and their jobs are requeued while the move runs. Copied rows get "
+        "new ids in the target shard."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('database', help='Target shard, one of settings.SHARD_DATABASES')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows inserted per query')
+
+    def handle(self, *args, **options):
+        target = options['database']
+        if target not in settings.SHARD_DATABASES:
+            raise CommandError(f"Unknown shard '{target}'; choose from {', '.join(settings.SHARD_DATABASES)}")
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f"User '{options['username']}' does not exist")
+
+        source = shard_for_user(user.pk)
+        if source == target:
+            self.stdout.write(f'{user.username} is already on {target}')
+            return
+
+        self.set_directory(user, source, moving=True)
+        try:
+            with transaction.atomic(using=source):
+                # Waits for writes in flight; writers that come later see
+                # the move when they get the lock (see lock_user_shard)
+                lock_user(user.pk, source)
+                with transaction.atomic(using=target):
+                    counts = self.copy_user_data(user, source, target, options['batch_size'])
+                self.set_directory(user, target, moving=False)
+                # The user now reads from the target; drop the old copy
+                # before releasing the lock
+                self.delete_user_data(user, source)
+        except Exception:
+            self.set_directory(user, source, moving=False)
+            raise
+
+        summary = ', '.join(f'{n} {name}' for name, n in counts.items())
+        self.stdout.write(self.style.SUCCESS(f'Moved {user.username} from {source} to {target}: {summary}'))
+
+    def set_directory(self, user, database, moving):
+        UserShard.objects.update_or_create(user=user, defaults={'database': database, 'moving': moving})
+
+    def delete_user_data(self, user, source):
+        with use_shard(source):
+            if source != 'default':
+                # Deleting the mirrored user cascades to all of their rows;
+                # the balance signals skip deletes that start from a user
+                User.objects.using(source).filter(pk=user.pk).delete()
+            else:
+                # The user stays in default, so delete their rows one model
+                # at a time; the series is dropped anyway, so post_delete
+                # must not update it once per transaction
+                with balance_updates_suspended():
+                    for model in (DailyBalance, Transaction, RecurringRule, Budget, SavingsGoal, Tag, Category):
+                        model.objects.using(source).filter(user_id=user.pk).delete()
+
+    def copy_rows(self, model, source, target, user, batch_size, remap=None):
+        """Copy a user's rows of `model` with new primary keys; return old -> new pk map"""
+        remap = remap or {}
+        rows = list(model.objects.using(source).filter(user_id=user.pk).order_by('pk'))
+        old_pks = [row.pk for row in rows]
+        for row in rows:
+            row.pk = None
+            row._state.adding = True
+            row._state.db = target
+            for field, mapping in remap.items():
+                value = getattr(row, field)
+                if value is not None:
+                    setattr(row, field, mapping[value])
+        # bulk_create skips save() and signals, so fingerprints and the
+        # daily balance series are copied as they are
+        model.objects.using(target).bulk_create(rows, batch_size=batch_size)
+        return dict(zip(old_pks, (row.pk for row in rows)))
+
+    def copy_user_data(self, user, source, target, batch_size):
+        mirror_user(user, target)
+
+        def copy(model, **remap):
+            return self.copy_rows(model, source, target, user, batch_size, remap)
+
+        categories = copy(Category)
+        tags = copy(Tag)
+        transactions = copy(Transaction, category_id=categories)
+        rules = copy(RecurringRule, category_id=categories)
+        budgets = copy(Budget, category_id=categories)
+        goals = copy(SavingsGoal)
+        balances = copy(DailyBalance)
+
+        links = TransactionTag.objects.using(source).filter(transaction__user_id=user.pk)
+        TransactionTag.objects.using(target).bulk_create(
+            [
+                TransactionTag(transaction_id=transactions[transaction_id], tag_id=tags[tag_id])
+                for transaction_id, tag_id in links.values_list('transaction_id', 'tag_id').iterator()
+            ],
+            batch_size=batch_size,
+        )
+        rule_links = RuleTag.objects.using(source).filter(recurringrule__user_id=user.pk)
+        RuleTag.objects.using(target).bulk_create(
+            [
+                RuleTag(recurringrule_id=rules[rule_id], tag_id=tags[tag_id])
+                for rule_id, tag_id in rule_links.values_list('recurringrule_id', 'tag_id').iterator()
+            ],
+            batch_size=batch_size,
+        )
+        with use_shard(target):
+            sync_tag_ids(Transaction.objects.filter(user_id=user.pk))
+            # The target may hold a version from an earlier stay; start a new one
+            touch(user_key(user.pk))
+
+        return {
+            'categories': len(categories),
+            'tags': len(tags),
+            'transactions': len(transactions),
+            'recurring rules': len(rules),
+            'budgets': len(budgets),
+            'savings goals': len(goals),
+            'daily balances': len(balances),
+        }
@@ -1,3 +1,30 @@
 from django.db import models
+from django.contrib.auth.models import User
+from api.models import currency_code_validator, default_currency
 
-# Create your models here.
+
+class Profile(models.Model):
+    """Per-user preferences"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
+    base_currency = models.CharField(
+        max_length=3,
+        default=default_currency,
+        validators=[currency_code_validator],
+        help_text='Currency that totals and reports are converted to'
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.user.username} ({self.base_currency})"
+
+
+class UserShard(models.Model):
+    """Directory entry mapping a user to the database holding their api data"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='shard')
+    database = models.CharField(max_length=100, help_text='Alias from settings.SHARD_DATABASES')
+    moving = models.BooleanField(default=False, help_text='Set while the user is being moved to another shard')
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.user.username} -> {self.database}"
@@ -0,0 +1,168 @@
+"""
+User-sharded database routing.
+
+Every model in the `api` app (except the global job queue) lives in the
+shard database of the user it belongs to. Users, auth tokens and profiles
+stay in `default`; each user row is mirrored into the user's shard so
+foreign keys and joins on `user` keep working there.
+
+The shard for the current request is held in a context variable, set by
+`UserShardMixin` once DRF has authenticated the user, or explicitly with
+`use_user_shard` / `use_shard` in workers and management commands.
+`UserShardRouter` sends every sharded query to that database.
+
+Writers lock the user's row in the shard with `lock_user_shard`, which
+`move_user_shard` holds while it copies the user: writes in flight finish
+before the copy, and later ones wait and then get `ShardMoving`.
+"""
+import contextvars
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import transaction
+from rest_framework.exceptions import APIException
+from rest_framework.permissions import SAFE_METHODS
+
+
+DEFAULT_DB = 'default'
+GLOBAL_MODELS = {'api.job'}
+
+_current_shard = contextvars.ContextVar('current_shard', default=None)
+
+
+def is_sharded(model):
+    """Whether rows of `model` live in per-user shards"""
+    return model._meta.app_label == 'api' and model._meta.label_lower not in GLOBAL_MODELS
+
+
+def current_shard():
+    """Database alias for sharded queries in the current context"""
+    return _current_shard.get() or DEFAULT_DB
+
+
+def get_user_shard(user_id):
+    """Return (database alias, moving flag) for a user from the directory.
+
+    Not cached: a stale answer after a move would send writes to the old shard.
+    """
+    from .models import UserShard
+    return (
+        UserShard.objects.filter(user_id=user_id)
+        .values_list('database', 'moving')
+        .first()
+    ) or (DEFAULT_DB, False)
+
+
+def shard_for_user(user_id):
+    return get_user_shard(user_id)[0]
+
+
+def assign_shard(user):
+    """Place a new user on a shard and record it in the directory"""
+    from .models import UserShard
+    shards = settings.SHARD_DATABASES
+    database = shards[user.pk % len(shards)]
+    UserShard.objects.update_or_create(user=user, defaults={'database': database})
+    return database
+
+
+def mirror_user(user, database=None):
+    """Copy a user row into its shard (same primary key)"""
+    database = database or shard_for_user(user.pk)
+    if database == DEFAULT_DB:
+        return
+    fields = {
+        field.attname: getattr(user, field.attname)
+        for field in user._meta.concrete_fields
+        if not field.primary_key
+    }
+    type(user).objects.using(database).update_or_create(pk=user.pk, defaults=fields)
+
+
+@contextmanager
+def use_shard(database):
+    """Route sharded queries in this block to `database`"""
+    token = _current_shard.set(database)
+    try:
+        yield database
+    finally:
+        _current_shard.reset(token)
+
+
+def use_user_shard(user_id):
+    """Route sharded queries in this block to the shard of `user_id`"""
+    return use_shard(shard_for_user(user_id) if user_id else DEFAULT_DB)
+
+
+class ShardMoving(APIException):
+    status_code = 503
+    default_detail = 'Your data is being moved; please retry shortly.'
+    default_code = 'shard_moving'
+
+
+def lock_user(user_id, using):
+    """Lock the user's row in `using` until the current transaction ends"""
+    from django.contrib.auth.models import User
+    list(User.objects.using(using).select_for_update().filter(pk=user_id).values_list('pk', flat=True))
+
+
+def lock_user_shard(user_id, using):
+    """Lock the user's row in `using` before writing their data there.
+
+    Must be called inside a transaction on `using`. Raises ShardMoving if
+    the user is being moved, or was moved away while this waited for the
+    lock, so the write never lands in a shard the user has left.
+    """
+    lock_user(user_id, using)
+    database, moving = get_user_shard(user_id)
+    if moving or database != using:
+        raise ShardMoving()
+
+
+class UserShardMixin:
+    """Route an API view's sharded queries to the authenticated user's shard.
+
+    Write requests run in a transaction on the shard that holds the user's
+    row lock (see `lock_user_shard`).
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        with ExitStack() as self._shard_context:
+            return super().dispatch(request, *args, **kwargs)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if request.user and request.user.is_authenticated:
+            database, moving = get_user_shard(request.user.pk)
+            if moving:
+                raise ShardMoving()
+            self._shard_context.enter_context(use_shard(database))
+            if request.method not in SAFE_METHODS:
+                self._shard_context.enter_context(transaction.atomic(using=database))
+                lock_user_shard(request.user.pk, database)
+
+
+class UserShardRouter:
+    """Send api models to the current user's shard and everything else to default"""
+
+    def _route(self, model, hints):
+        if not is_sharded(model):
+            return None
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        return current_shard()
+
+    def db_for_read(self, model, **hints):
+        return self._route(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._route(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Sharded rows may point at the user (or other global rows) in default
+        if obj1._state.db == obj2._state.db:
+            return True
+        if not is_sharded(type(obj1)) or not is_sharded(type(obj2)):
+            return True
+        return False
@@ -0,0 +1,37 @@
+"""
+Signal handlers that keep each user's shard assignment and mirror row in sync.
+"""
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .sharding import (
+    DEFAULT_DB, assign_shard, mirror_user, shard_for_user, use_shard
+)
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, using, **kwargs):
+    """Assign new users to a shard and copy user changes into it"""
+    if using != DEFAULT_DB:
+        return
+    database = assign_shard(instance) if created else shard_for_user(instance.pk)
+    mirror_user(instance, database)
+
+
+@receiver(pre_delete, sender=User)
+def remember_user_shard(sender, instance, using, **kwargs):
+    """Look up the shard before the directory entry is deleted with the user"""
+    if using == DEFAULT_DB:
+        instance._shard_database = shard_for_user(instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, using, **kwargs):
+    """Remove the mirrored user, and with it their sharded data"""
+    if using != DEFAULT_DB:
+        return
+    database = getattr(instance, '_shard_database', DEFAULT_DB)
+    if database != DEFAULT_DB:
+        with use_shard(database):
+            User.objects.using(database).filter(pk=instance.pk).delete()
@@ -1,3 +1,118 @@
+from datetime import date
+from io import StringIO
+from unittest import skipUnless
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import transaction
 from django.test import TestCase
+from rest_framework.test import APIClient
+
+from api.models import DailyBalance, Tag, Transaction
+from api.throttling import reset_bucket_store
+from .models import UserShard
+from .sharding import ShardMoving, lock_user_shard, shard_for_user, use_shard
+
+
+@skipUnless('shard1' in settings.DATABASES, 'run with DATABASE_SHARDS=shard1')
+class ShardingTests(TestCase):
+    """Placement, routing and moves of users across shards"""
+
+    # Every configured database, i.e. default and shard1 (naming shard1
+    # outright would break test setup when it isn't configured)
+    databases = '__all__'
+
+    def setUp(self):
+        reset_bucket_store()
+        self.client = APIClient()
+
+    def register(self, username):
+        response = self.client.post('/api/auth/register/', {
+            'username': username,
+            'email': f'{username}@example.com',
+            'password': 'Shard-test-password-1',
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        return User.objects.get(username=username)
+
+    def user_on(self, database):
+        """Register users until one is placed on `database`"""
+        for index in range(len(settings.SHARD_DATABASES)):
+            user = self.register(f'{database}_{index}')
+            if shard_for_user(user.pk) == database:
+                return user
+        self.fail(f'No user was placed on {database}')
+
+    def test_signup_placement(self):
+        for index in range(4):
+            user = self.register(f'user{index}')
+            expected = settings.SHARD_DATABASES[user.pk % len(settings.SHARD_DATABASES)]
+            self.assertEqual(UserShard.objects.get(user=user).database, expected)
+            # Every shard but default holds a mirror of its users
+            self.assertEqual(User.objects.using('shard1').filter(pk=user.pk).exists(), expected == 'shard1')
+
+    def test_crud_lands_on_shard(self):
+        user = self.user_on('shard1')
+        self.client.force_authenticate(user)
+
+        response = self.client.post('/api/transactions/', {
+            'amount': '12.50', 'type': 'expense', 'date': '2024-03-01', 'description': 'lunch',
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(Transaction.objects.using('shard1').filter(pk=response.data['id'], user=user).exists())
+        self.assertFalse(Transaction.objects.using('default').filter(user_id=user.pk).exists())
+        self.assertTrue(DailyBalance.objects.using('shard1').filter(user_id=user.pk).exists())
+
+        response = self.client.get('/api/transactions/')
+        self.assertEqual([row['description'] for row in response.data['results']], ['lunch'])
+
+    def test_moving_user_gets_503(self):
+        user = self.user_on('shard1')
+        UserShard.objects.filter(user=user).update(moving=True)
+        self.client.force_authenticate(user)
+        self.assertEqual(self.client.get('/api/transactions/').status_code, 503)
+
+    def test_write_after_move_gets_503(self):
+        # A writer that routed to shard1 and then got the user's row lock
+        # after a move finished must not write there
+        user = self.user_on('shard1')
+        with use_shard('shard1'), transaction.atomic(using='shard1'):
+            UserShard.objects.filter(user=user).update(database='default')
+            with self.assertRaises(ShardMoving):
+                lock_user_shard(user.pk, 'shard1')
+
+    def test_move_user_shard(self):
+        user = self.user_on('shard1')
+        with use_shard('shard1'):
+            tag = Tag.objects.create(user=user, name='work')
+            for day in (1, 2):
+                taxi = Transaction.objects.create(
+                    user=user, amount='10.00', type='expense', date=date(2024, 1, day), description='taxi'
+                )
+                taxi.tags.add(tag)
+        self.assertEqual(DailyBalance.objects.using('shard1').filter(user_id=user.pk).count(), 2)
+
+        call_command('move_user_shard', user.username, 'default', stdout=StringIO())
+
+        self.assertEqual(UserShard.objects.get(user=user).database, 'default')
+        self.assertFalse(UserShard.objects.get(user=user).moving)
+        self.assertFalse(User.objects.using('shard1').filter(pk=user.pk).exists())
+        self.assertFalse(Transaction.objects.using('shard1').filter(user_id=user.pk).exists())
+        self.assertFalse(DailyBalance.objects.using('shard1').filter(user_id=user.pk).exists())
+
+        moved = Transaction.objects.using('default').filter(user=user)
+        self.assertEqual(moved.count(), 2)
+        moved_tag = Tag.objects.using('default').get(user=user)
+        self.assertEqual({tuple(t.tag_ids) for t in moved}, {(moved_tag.pk,)})
+        self.assertEqual(
+            list(DailyBalance.objects.using('default').filter(user=user).order_by('date').values_list('balance', flat=True)),
+            [-10, -20]
+        )
 
-# Create your tests here.
+        # And back again, deleting the source rows from default
+        call_command('move_user_shard', user.username, 'shard1', stdout=StringIO())
+        self.assertEqual(Transaction.objects.using('shard1').filter(user_id=user.pk).count(), 2)
+        self.assertFalse(Transaction.objects.using('default').filter(user_id=user.pk).exists())
+        self.assertFalse(DailyBalance.objects.using('default').filter(user_id=user.pk).exists())
+        self.assertTrue(User.objects.using('default').filter(pk=user.pk).exists())
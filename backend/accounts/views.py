@@ -3,6 +3,7 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 from django.contrib.auth.models import User
 from api.serializers import UserSerializer
 
@@ -12,6 +13,7 @@ class RegisterView(generics.CreateAPIView):
     queryset = User.objects.all()
     permission_classes = [AllowAny]
     serializer_class = UserSerializer
+    throttle_scope = 'auth'
     
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
@@ -30,6 +32,16 @@ class RegisterView(generics.CreateAPIView):
         }, status=status.HTTP_201_CREATED)
 
 
+class LoginView(TokenObtainPairView):
+    """Obtain a JWT pair, throttled per client in the `auth` scope"""
+    throttle_scope = 'auth'
+
+
+class RefreshView(TokenRefreshView):
+    """Refresh a JWT, throttled per client in the `auth` scope"""
+    throttle_scope = 'auth'
+
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def logout_view(request):
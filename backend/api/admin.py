@@ -1,10 +1,48 @@
 from django.contrib import admin
-from .models import Category, Tag, Transaction, Budget, SavingsGoal
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+from .models import Category, Tag, Transaction, RecurringRule, Budget, SavingsGoal, Job, DailyBalance, ExchangeRate
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator that uses the planner's row estimate for large unfiltered tables.
+
+    An exact COUNT(*) over millions of rows dominates changelist load time.
+    On PostgreSQL the unfiltered count is read from pg_class instead; filtered
+    querysets and small tables still get an exact count.
+    """
+    estimate_threshold = 100000
+    
+    @cached_property
+    def count(self):
+        query = self.object_list.query
+        connection = connections[self.object_list.db]
+        if connection.vendor == 'postgresql' and not query.where:
+            with connection.cursor() as cursor:
+                # regclass resolves the name on the search path, unlike a
+                # relname match that also hits same-named tables in other schemas
+                cursor.execute(
+                    'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                    [connection.ops.quote_name(self.object_list.model._meta.db_table)]
+                )
+                row = cursor.fetchone()
+            if row and row[0] >= self.estimate_threshold:
+                return row[0]
+        return super().count
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Changelist defaults for user-owned tables that grow without bound"""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_per_page = 50
 
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
     list_display = ('name', 'type', 'user', 'color', 'created_at')
+    list_select_related = ('user',)
     list_filter = ('type', 'created_at')
     search_fields = ('name', 'user__username')
     readonly_fields = ('created_at', 'updated_at')
@@ -13,30 +51,81 @@ class CategoryAdmin(admin.ModelAdmin):
 @admin.register(Tag)
 class TagAdmin(admin.ModelAdmin):
     list_display = ('name', 'user', 'created_at')
+    list_select_related = ('user',)
     search_fields = ('name', 'user__username')
     readonly_fields = ('created_at',)
 
 
 @admin.register(Transaction)
-class TransactionAdmin(admin.ModelAdmin):
-    list_display = ('description', 'amount', 'type', 'date', 'category', 'user', 'created_at')
-    list_filter = ('type', 'date', 'category', 'created_at')
+class TransactionAdmin(LargeTableAdmin):
+    list_display = ('description', 'amount', 'currency', 'type', 'date', 'category', 'user', 'created_at')
+    list_filter = ('type', 'date', 'created_at')
+    list_select_related = ('category', 'user')
     search_fields = ('description', 'user__username', 'category__name')
+    autocomplete_fields = ('category', 'tags', 'user')
     readonly_fields = ('created_at', 'updated_at')
-    date_hierarchy = 'date'
+
+
+@admin.register(RecurringRule)
+class RecurringRuleAdmin(LargeTableAdmin):
+    list_display = ('description', 'amount', 'currency', 'type', 'frequency', 'interval', 'start_date', 'end_date', 'user')
+    list_filter = ('type', 'frequency')
+    list_select_related = ('category', 'user')
+    search_fields = ('description', 'user__username', 'category__name')
+    autocomplete_fields = ('category', 'tags', 'user')
+    readonly_fields = ('materialized_until', 'created_at', 'updated_at')
 
 
 @admin.register(Budget)
-class BudgetAdmin(admin.ModelAdmin):
-    list_display = ('category', 'amount', 'period', 'year', 'month', 'user', 'created_at')
+class BudgetAdmin(LargeTableAdmin):
+    list_display = ('category', 'amount', 'currency', 'period', 'year', 'month', 'user', 'created_at')
     list_filter = ('period', 'year', 'month', 'created_at')
+    list_select_related = ('category', 'user')
     search_fields = ('category__name', 'user__username')
+    autocomplete_fields = ('category', 'user')
     readonly_fields = ('created_at', 'updated_at')
 
 
 @admin.register(SavingsGoal)
-class SavingsGoalAdmin(admin.ModelAdmin):
-    list_display = ('name', 'target_amount', 'current_amount', 'deadline', 'user', 'created_at')
+class SavingsGoalAdmin(LargeTableAdmin):
+    list_display = ('name', 'target_amount', 'current_amount', 'currency', 'deadline', 'user', 'created_at')
     list_filter = ('deadline', 'created_at')
+    list_select_related = ('user',)
     search_fields = ('name', 'user__username')
+    autocomplete_fields = ('user',)
     readonly_fields = ('created_at', 'updated_at', 'progress_percentage', 'remaining_amount')
+
+
+@admin.register(Job)
+class JobAdmin(LargeTableAdmin):
+    list_display = ('kind', 'status', 'progress', 'attempts', 'user', 'run_at', 'created_at')
+    list_filter = ('status', 'kind', 'created_at')
+    list_select_related = ('user',)
+    search_fields = ('kind', 'user__username')
+    readonly_fields = ('created_at', 'updated_at', 'started_at', 'finished_at', 'heartbeat_at')
+
+
+@admin.register(DailyBalance)
+class DailyBalanceAdmin(LargeTableAdmin):
+    list_display = ('date', 'user', 'income', 'expenses', 'net', 'balance')
+    list_select_related = ('user',)
+    search_fields = ('user__username',)
+    autocomplete_fields = ('user',)
+
+
+@admin.register(ExchangeRate)
+class ExchangeRateAdmin(LargeTableAdmin):
+    list_display = ('currency', 'date', 'rate')
+    list_filter = ('currency',)
+    search_fields = ('currency',)
+    
+    # Every shard holds a copy of the rates and the admin only writes to
+    # default; load them with `manage.py load_fx_rates`, which writes to all
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        return False
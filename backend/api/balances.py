@@ -0,0 +1,167 @@
+"""
+Income/expense aggregation and the materialized daily balance series.
+
+`DailyBalance` holds one row per user and day with transactions, in the
+user's base currency. Writes to `Transaction` adjust it incrementally through
+`apply_delta` (see api.signals); `rebuild_balances` recomputes a user's
+series from scratch.
+"""
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import router, transaction
+from django.db.models import Count, DecimalField, F, Q, Sum, Value
+from django.db.models.functions import Coalesce
+
+from accounts.sharding import lock_user_shard
+
+from .currency import converted_amount, get_base_currency
+from .models import DailyBalance, Transaction
+
+
+ZERO = Decimal('0.00')
+
+
+def _total(transaction_type, currency=None):
+    amount = converted_amount(currency) if currency else F('amount')
+    return Coalesce(
+        Sum(amount, filter=Q(type=transaction_type)),
+        Value(ZERO),
+        output_field=DecimalField(max_digits=14, decimal_places=2)
+    )
+
+
+def income_expense_totals(transactions, currency=None):
+    """Total income, total expenses and count for a transaction queryset in one query.
+
+    With `currency`, amounts are converted inside the SUM.
+    """
+    return transactions.aggregate(
+        total_income=_total(Transaction.INCOME, currency),
+        total_expenses=_total(Transaction.EXPENSE, currency),
+        transaction_count=Count('id'),
+    )
+
+
+def signed_amount(transaction_type, amount):
+    """Contribution of a transaction to the balance: income adds, expenses subtract"""
+    amount = Decimal(str(amount))
+    return amount if transaction_type == Transaction.INCOME else -amount
+
+
+def lock_series(user_id, using):
+    """Serialize writes to a user's series by locking the user's row in `using`.
+
+    Must be called inside a transaction on `using`. Every shard holds a copy
+    of the user row, so this works wherever the series lives. Raises
+    ShardMoving while the user is being moved (see `lock_user_shard`).
+    """
+    lock_user_shard(user_id, using)
+
+
+def apply_delta(user_id, date, transaction_type, amount):
+    """Add one transaction's base-currency amount (negative to remove it) to the daily series.
+
+    Updates the day's row and shifts the running balance of that day and
+    every later day with a single set-based UPDATE. Run it in the same
+    transaction as the write it accounts for, so both commit or neither.
+    """
+    amount = Decimal(str(amount))
+    net = signed_amount(transaction_type, amount)
+    income = amount if transaction_type == Transaction.INCOME else ZERO
+    expenses = ZERO if transaction_type == Transaction.INCOME else amount
+
+    using = router.db_for_write(DailyBalance)
+    with transaction.atomic(using=using):
+        lock_series(user_id, using)
+        if not DailyBalance.objects.filter(user_id=user_id, date=date).exists():
+            previous = (
+                DailyBalance.objects.filter(user_id=user_id, date__lt=date)
+                .order_by('-date')
+                .values_list('balance', flat=True)
+                .first()
+            )
+            DailyBalance.objects.bulk_create(
+                [DailyBalance(user_id=user_id, date=date, balance=previous or ZERO)],
+                ignore_conflicts=True,
+            )
+
+        DailyBalance.objects.filter(user_id=user_id, date=date).update(
+            income=F('income') + income,
+            expenses=F('expenses') + expenses,
+            net=F('net') + net,
+        )
+        DailyBalance.objects.filter(user_id=user_id, date__gte=date).update(
+            balance=F('balance') + net
+        )
+
+
+def rebuild_balances(user_id):
+    """Recompute a user's daily series from their transactions"""
+    using = router.db_for_write(DailyBalance)
+    with transaction.atomic(using=using):
+        # Aggregate under the lock, so a concurrent apply_delta either commits
+        # before the read or waits for the new series
+        lock_series(user_id, using)
+        currency = get_base_currency(user_id)
+        days = (
+            Transaction.objects.using(using).filter(user_id=user_id)
+            .values('date')
+            .annotate(
+                income=_total(Transaction.INCOME, currency),
+                expenses=_total(Transaction.EXPENSE, currency)
+            )
+            .order_by('date')
+        )
+
+        rows = []
+        balance = ZERO
+        for day in days:
+            net = day['income'] - day['expenses']
+            balance += net
+            rows.append(DailyBalance(
+                user_id=user_id,
+                date=day['date'],
+                income=day['income'],
+                expenses=day['expenses'],
+                net=net,
+                balance=balance,
+            ))
+
+        DailyBalance.objects.filter(user_id=user_id).delete()
+        DailyBalance.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
+
+
+def balance_series(user_id, start_date, end_date):
+    """Daily balance points for every day in [start_date, end_date]"""
+    opening = (
+        DailyBalance.objects.filter(user_id=user_id, date__lt=start_date)
+        .order_by('-date')
+        .values_list('balance', flat=True)
+        .first()
+    ) or ZERO
+    rows = {
+        row['date']: row
+        for row in DailyBalance.objects.filter(
+            user_id=user_id,
+            date__range=[start_date, end_date]
+        ).values('date', 'income', 'expenses', 'net', 'balance')
+    }
+
+    points = []
+    balance = opening
+    day = start_date
+    while day <= end_date:
+        row = rows.get(day)
+        if row:
+            balance = row['balance']
+        points.append({
+            'date': day,
+            'income': float(row['income']) if row else 0.0,
+            'expenses': float(row['expenses']) if row else 0.0,
+            'net': float(row['net']) if row else 0.0,
+            'balance': float(balance),
+        })
+        day += timedelta(days=1)
+    return opening, points
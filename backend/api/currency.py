@@ -0,0 +1,162 @@
+"""
+Currency conversion.
+
+Exchange rates are stored per currency and date against
+`settings.FX_PIVOT_CURRENCY` and loaded with `manage.py load_fx_rates`. A
+transaction converts at the latest rate on or before its date, or the
+earliest loaded rate if it predates them all. The API only accepts
+currencies that have rates (`validate_convertible_currency`); amounts in a
+currency without any rate, which can only come from older data, are
+counted at par so totals never silently drop them.
+
+`converted_amount` builds a SQL expression for use inside aggregates, so
+converted totals need no extra queries. Both it and the cache round each
+converted amount to cents (halves away from zero, like SQL ROUND), so SQL
+totals and sums of single conversions agree. `rates` is an in-process cache of
+the rate table for converting single values in Python (serializers,
+incremental balance updates); it reloads when `rates_version`, stored in
+the database (see api.versions), changes.
+"""
+import threading
+import time
+from bisect import bisect_right
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Case, DecimalField, F, OuterRef, Subquery, Value, When
+from django.db.models.functions import Coalesce, Round
+
+from .models import ExchangeRate
+from .versions import RATES, get_versions
+
+
+ONE = Decimal('1')
+CENTS = Decimal('0.01')
+
+
+def get_base_currency(user_id):
+    """Return a user's base currency.
+
+    Read from the database on every call: balances written with a stale
+    currency would stay wrong, and per-process caches can't be invalidated
+    from other processes. Serializers memoize it per request.
+    """
+    from accounts.models import Profile
+    return (
+        Profile.objects.filter(user_id=user_id)
+        .values_list('base_currency', flat=True)
+        .first()
+    ) or settings.DEFAULT_CURRENCY
+
+
+def rates_version():
+    """Version of the rate table; load_fx_rates and rate edits change it"""
+    return get_versions(RATES)[0]
+
+
+def validate_convertible_currency(currency):
+    """Reject currencies that have no exchange rate to convert with"""
+    if currency == settings.FX_PIVOT_CURRENCY:
+        return
+    if not ExchangeRate.objects.filter(currency=currency).exists():
+        raise ValidationError(
+            f'No exchange rates are loaded for {currency}.',
+            code='unknown_currency'
+        )
+
+
+def _rate_expression(currency, date_field):
+    """Rate of `currency` (a constant or an F expression) on the row's date"""
+    if currency == settings.FX_PIVOT_CURRENCY:
+        return Value(ONE)
+    rate = Subquery(
+        ExchangeRate.objects.filter(currency=currency, date__lte=OuterRef(date_field))
+        .order_by('-date')
+        .values('rate')[:1]
+    )
+    earliest = Subquery(
+        ExchangeRate.objects.filter(currency=currency)
+        .order_by('date')
+        .values('rate')[:1]
+    )
+    return Coalesce(rate, earliest, Value(ONE))
+
+
+def converted_amount(target_currency, amount_field='amount', currency_field='currency', date_field='date'):
+    """SQL expression converting each row's amount into `target_currency`"""
+    output_field = DecimalField(max_digits=20, decimal_places=2)
+    source_rate = Case(
+        When(**{currency_field: settings.FX_PIVOT_CURRENCY}, then=Value(ONE)),
+        default=_rate_expression(OuterRef(currency_field), date_field),
+    )
+    return Case(
+        When(**{currency_field: target_currency}, then=F(amount_field)),
+        default=Round(F(amount_field) * source_rate / _rate_expression(target_currency, date_field), 2),
+        output_field=output_field,
+    )
+
+
+class RateCache:
+    """In-process copy of the rate table, reloaded when new rates are loaded"""
+
+    check_interval = 60
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rates = {}
+        self._version = None
+        self._checked_at = 0
+
+    def _refresh(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        version = rates_version()
+        if version == self._version:
+            return
+
+        rates = {}
+        for currency, date, rate in (
+            ExchangeRate.objects.order_by('currency', 'date')
+            .values_list('currency', 'date', 'rate')
+            .iterator()
+        ):
+            dates, values = rates.setdefault(currency, ([], []))
+            dates.append(date)
+            values.append(rate)
+        self._rates = rates
+        self._version = version
+
+    def rate(self, currency, date):
+        """Pivot-currency rate of `currency` on `date` (at par if it has no rates)"""
+        if currency == settings.FX_PIVOT_CURRENCY:
+            return ONE
+        with self._lock:
+            self._refresh()
+            dates, values = self._rates.get(currency, ((), ()))
+        if not values:
+            return ONE
+        index = bisect_right(dates, date)
+        return values[max(index - 1, 0)]
+
+    def convert(self, amount, source, target, date):
+        """Convert `amount` from `source` to `target` currency at `date`"""
+        amount = Decimal(str(amount))
+        if source == target:
+            return amount
+        converted = amount * self.rate(source, date) / self.rate(target, date)
+        return converted.quantize(CENTS, rounding=ROUND_HALF_UP)
+
+    def invalidate(self):
+        with self._lock:
+            self._checked_at = 0
+
+
+rates = RateCache()
+
+
+def rates_changed():
+    """Reload this process's rate cache now; others notice the new version within `check_interval`"""
+    rates.invalidate()
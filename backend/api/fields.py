@@ -0,0 +1,52 @@
+"""
+Array columns that fall back to portable storage off PostgreSQL.
+
+On PostgreSQL `IdArrayField` is a native bigint[] and `PortableGinIndex` a
+GIN index, so `tag_ids` filters use the array operators. Other backends
+(SQLite stand-ins for tests and load tests) store the list as JSON text
+under a plain index; code that filters or rebuilds the column checks
+`has_native_arrays` and goes through the M2M table there instead.
+"""
+import json
+
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
+from django.db import connections, models
+
+
+def has_native_arrays(using):
+    """Whether the database alias `using` has array columns and operators"""
+    return connections[using].vendor == 'postgresql'
+
+
+class IdArrayField(ArrayField):
+    """Array of ids, stored as a JSON list in a text column off PostgreSQL"""
+
+    def db_type(self, connection):
+        if connection.vendor == 'postgresql':
+            return super().db_type(connection)
+        return 'text'
+
+    def get_placeholder(self, value, compiler, connection):
+        if connection.vendor == 'postgresql':
+            return super().get_placeholder(value, compiler, connection)
+        return '%s'
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if connection.vendor == 'postgresql' or value is None or isinstance(value, str):
+            return super().get_db_prep_value(value, connection, prepared)
+        return json.dumps([int(item) for item in value])
+
+    def from_db_value(self, value, expression, connection):
+        if isinstance(value, str):
+            return json.loads(value)
+        return value
+
+
+class PortableGinIndex(GinIndex):
+    """GIN index on PostgreSQL, a plain index elsewhere"""
+
+    def create_sql(self, model, schema_editor, using='', **kwargs):
+        if schema_editor.connection.vendor == 'postgresql':
+            return super().create_sql(model, schema_editor, using=using, **kwargs)
+        return models.Index.create_sql(self, model, schema_editor, using=using, **kwargs)
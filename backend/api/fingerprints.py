@@ -0,0 +1,53 @@
+"""
+Content fingerprints used to detect duplicate transactions.
+
+Two transactions are duplicates when they belong to the same user and have
+the same date, type, amount, currency and normalized description.
+
+Only rows stored by bulk ingestion are kept unique, by their import key:
+identical purchases entered by hand, or repeated within one upload, are
+separate transactions.
+"""
+import hashlib
+import re
+import unicodedata
+from decimal import Decimal
+
+
+WHITESPACE_RE = re.compile(r'\s+')
+
+
+def normalize_description(description):
+    """Case-fold and collapse whitespace so cosmetic differences don't matter"""
+    text = unicodedata.normalize('NFKC', description or '').casefold()
+    return WHITESPACE_RE.sub(' ', text).strip()
+
+
+def transaction_fingerprint(user_id, date, transaction_type, amount, currency, description):
+    """Return the hex SHA-256 content fingerprint of a transaction"""
+    amount = Decimal(str(amount)).quantize(Decimal('0.01'))
+    date = date.isoformat() if hasattr(date, 'isoformat') else str(date)
+    key = '|'.join([
+        str(user_id),
+        date,
+        transaction_type,
+        str(amount),
+        currency,
+        normalize_description(description),
+    ])
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def import_key(fingerprint, sequence=0):
+    """Import key of the `sequence`-th row with this fingerprint in one upload.
+
+    A retried upload repeats the same sequence, so it maps to the same keys.
+    """
+    if not sequence:
+        return fingerprint
+    return hashlib.sha256(f'{fingerprint}|{sequence}'.encode('utf-8')).hexdigest()
+
+
+def occurrence_key(rule_id, date):
+    """Import key of a recurring rule's occurrence on `date`"""
+    return hashlib.sha256(f'recurring|{rule_id}|{date.isoformat()}'.encode('utf-8')).hexdigest()
@@ -0,0 +1,253 @@
+"""
+Cash-flow, budget and savings-goal forecasts.
+
+A user's transaction history is loaded in one query into NumPy arrays and
+bucketed into monthly income/expense series in the user's base currency. Each series is projected with a
+least-squares linear trend plus a month-of-year seasonal component (once two
+years of history are available). Results are cached per user under the
+stored versions of their data and of the rates (see api.versions), so a
+change made by any process is seen by every other one whatever the cache
+backend; a shared backend also shares computed forecasts.
+"""
+import calendar
+from datetime import date, timedelta
+
+import numpy as np
+from django.core.cache import cache
+from django.utils import timezone
+
+from .currency import converted_amount, get_base_currency, rates
+from .models import Budget, SavingsGoal, Transaction
+from .versions import RATES, get_versions, user_key
+
+
+HISTORY_MONTHS = 36
+TREND_MONTHS = 12
+CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def _month_index(years, months):
+    return years * 12 + (months - 1)
+
+
+def _index_to_date(index):
+    return date(int(index) // 12, int(index) % 12 + 1, 1)
+
+
+def _days_in_month(index):
+    year, month = int(index) // 12, int(index) % 12 + 1
+    return calendar.monthrange(year, month)[1]
+
+
+def load_history(user_id, today):
+    """Load the user's recent transactions, in their base currency, as parallel NumPy arrays"""
+    start = date(today.year - HISTORY_MONTHS // 12, today.month, 1)
+    rows = list(
+        Transaction.objects.filter(user_id=user_id, date__gte=start, date__lte=today)
+        .annotate(base_amount=converted_amount(get_base_currency(user_id)))
+        .values_list('date', 'type', 'base_amount', 'category_id')
+    )
+    if not rows:
+        empty = np.array([], dtype=np.int64)
+        return {
+            'month': empty, 'income': np.array([], dtype=bool),
+            'amount': np.array([], dtype=float), 'category': empty,
+        }
+
+    dates, types, amounts, categories = zip(*rows)
+    return {
+        'month': np.fromiter((_month_index(d.year, d.month) for d in dates), dtype=np.int64, count=len(rows)),
+        'income': np.array(types) == Transaction.INCOME,
+        'amount': np.array(amounts, dtype=float),
+        'category': np.array([c or 0 for c in categories], dtype=np.int64),
+    }
+
+
+def project_series(values, first_month, horizon):
+    """Project a monthly series `horizon` months ahead with trend plus seasonality"""
+    n = len(values)
+    if n == 0:
+        return np.zeros(horizon)
+
+    x = np.arange(n)
+    recent = slice(max(0, n - TREND_MONTHS), n)
+    if n >= 3:
+        slope, intercept = np.polyfit(x[recent], values[recent], 1)
+    else:
+        slope, intercept = 0.0, values.mean()
+
+    future = np.arange(n, n + horizon)
+    projection = intercept + slope * future
+
+    if n >= 24:
+        # Average residual per calendar month, centered so it sums to zero
+        residuals = values - (intercept + slope * x)
+        month_of_year = (first_month + x) % 12
+        counts = np.bincount(month_of_year, minlength=12)
+        seasonal = np.bincount(month_of_year, weights=residuals, minlength=12) / np.maximum(counts, 1)
+        seasonal -= seasonal.mean()
+        projection += seasonal[(first_month + future) % 12]
+
+    return np.clip(projection, 0, None)
+
+
+def forecast_cash_flow(history, current_month, months):
+    """Monthly projected income, expenses, net and cumulative net"""
+    first_month = current_month - HISTORY_MONTHS
+    offsets = history['month'] - first_month
+    # Only complete months feed the model
+    complete = offsets < HISTORY_MONTHS
+    size = HISTORY_MONTHS
+    income = np.bincount(offsets[complete & history['income']], weights=history['amount'][complete & history['income']], minlength=size)
+    expenses = np.bincount(offsets[complete & ~history['income']], weights=history['amount'][complete & ~history['income']], minlength=size)
+
+    # Skip leading months before the user's first transaction
+    active = np.flatnonzero((income + expenses) > 0)
+    start = active[0] if len(active) else size
+    income_projection = project_series(income[start:], first_month + start, months + 1)
+    expense_projection = project_series(expenses[start:], first_month + start, months + 1)
+
+    net = income_projection - expense_projection
+    cumulative = np.cumsum(net[1:])
+    return [
+        {
+            'month': _index_to_date(current_month + i).strftime('%Y-%m'),
+            'income': round(float(income_projection[i]), 2),
+            'expenses': round(float(expense_projection[i]), 2),
+            'net': round(float(net[i]), 2),
+            'cumulative_net': round(float(cumulative[i - 1]), 2),
+        }
+        for i in range(1, months + 1)
+    ], float(net[1:].mean()) if months else 0.0
+
+
+def forecast_budgets(user_id, history, today, current_month):
+    """Projected period-end spend for every budget covering today"""
+    budgets = list(
+        Budget.objects.filter(user_id=user_id, year=today.year)
+        .select_related('category')
+        .order_by('category__name')
+    )
+    budgets = [
+        b for b in budgets
+        if b.period == Budget.YEARLY or (b.period == Budget.MONTHLY and b.month == today.month)
+    ]
+    if not budgets:
+        return []
+
+    expense = ~history['income']
+    category_ids = np.array([b.category_id for b in budgets], dtype=np.int64)
+    yearly = np.array([b.period == Budget.YEARLY for b in budgets])
+    base_currency = get_base_currency(user_id)
+    limits = np.array([float(rates.convert(b.amount, b.currency, base_currency, today)) for b in budgets])
+
+    # Spend so far in each budget's period: (budgets x transactions) masks
+    matches = (history['category'][None, :] == category_ids[:, None]) & expense[None, :]
+    in_month = history['month'] == current_month
+    in_year = history['month'] >= _month_index(today.year, 1)
+    in_period = np.where(yearly[:, None], in_year[None, :], in_month[None, :])
+    spent = (matches & in_period) @ history['amount']
+
+    # Historical daily spend rate per category over the previous 12 full months
+    previous_year = (history['month'] >= current_month - 12) & (history['month'] < current_month)
+    history_days = sum(_days_in_month(m) for m in range(current_month - 12, current_month))
+    historical_rate = (matches & previous_year[None, :]) @ history['amount'] / history_days
+
+    year_days = 366 if calendar.isleap(today.year) else 365
+    period_days = np.where(yearly, year_days, _days_in_month(current_month))
+    elapsed_days = np.where(yearly, today.timetuple().tm_yday, today.day)
+    remaining_days = period_days - elapsed_days
+
+    # Blend the current pace with history, trusting the pace more as the period progresses
+    pace_rate = spent / elapsed_days
+    weight = elapsed_days / period_days
+    projected = spent + remaining_days * (weight * pace_rate + (1 - weight) * historical_rate)
+    utilization = np.divide(projected * 100, limits, out=np.zeros_like(projected), where=limits > 0)
+
+    return [
+        {
+            'budget': budget.pk,
+            'category': budget.category_id,
+            'category_name': budget.category.name,
+            'period': budget.period,
+            'amount': float(limits[i]),
+            'spent_amount': round(float(spent[i]), 2),
+            'projected_amount': round(float(projected[i]), 2),
+            'projected_percentage': round(float(utilization[i]), 1),
+            'projected_over_budget': bool(projected[i] > limits[i]),
+        }
+        for i, budget in enumerate(budgets)
+    ]
+
+
+def forecast_savings_goals(user_id, today, monthly_net):
+    """Expected completion date of each savings goal at its current pace"""
+    goals = list(SavingsGoal.objects.filter(user_id=user_id).order_by('-created_at'))
+    if not goals:
+        return []
+
+    base_currency = get_base_currency(user_id)
+    current = np.array([float(rates.convert(g.current_amount, g.currency, base_currency, today)) for g in goals])
+    target = np.array([float(rates.convert(g.target_amount, g.currency, base_currency, today)) for g in goals])
+    remaining = np.maximum(target - current, 0)
+    age_months = np.array([max((today - g.created_at.date()).days, 1) / 30.44 for g in goals])
+
+    # Pace so far, or an even share of the projected net cash flow for goals
+    # that have not received anything yet
+    rate = current / np.maximum(age_months, 1)
+    open_goals = max(int((remaining > 0).sum()), 1)
+    rate = np.where(rate > 0, rate, max(monthly_net, 0) / open_goals)
+
+    months_needed = np.divide(remaining, rate, out=np.full_like(remaining, np.inf), where=rate > 0)
+
+    results = []
+    for i, goal in enumerate(goals):
+        if remaining[i] == 0:
+            completion = today
+        elif np.isfinite(months_needed[i]):
+            completion = today + timedelta(days=int(np.ceil(months_needed[i] * 30.44)))
+        else:
+            completion = None
+
+        required = None
+        if goal.deadline and remaining[i] > 0:
+            months_left = max((goal.deadline - today).days / 30.44, 0)
+            required = round(float(remaining[i] / months_left), 2) if months_left else None
+
+        results.append({
+            'goal': goal.pk,
+            'name': goal.name,
+            'remaining_amount': round(float(remaining[i]), 2),
+            'monthly_rate': round(float(rate[i]), 2),
+            'expected_completion': completion,
+            'deadline': goal.deadline,
+            'on_track': (
+                None if goal.deadline is None
+                else completion is not None and completion <= goal.deadline
+            ),
+            'required_monthly_amount': required,
+        })
+    return results
+
+
+def build_forecast(user_id, months=6, today=None):
+    """Cash flow, budget and savings-goal forecasts for a user, cached until their data changes"""
+    today = today or timezone.now().date()
+    version, rates_version = get_versions(user_key(user_id), RATES)
+    cache_key = f'forecast_{user_id}_{version}_{rates_version}_{today.isoformat()}_{months}'
+    forecast = cache.get(cache_key)
+    if forecast is not None:
+        return forecast
+
+    current_month = _month_index(today.year, today.month)
+    history = load_history(user_id, today)
+    cash_flow, monthly_net = forecast_cash_flow(history, current_month, months)
+    forecast = {
+        'generated_on': today,
+        'currency': get_base_currency(user_id),
+        'cash_flow': cash_flow,
+        'budgets': forecast_budgets(user_id, history, today, current_month),
+        'savings_goals': forecast_savings_goals(user_id, today, monthly_net),
+    }
+    cache.set(cache_key, forecast, CACHE_TIMEOUT)
+    return forecast
@@ -0,0 +1,127 @@
+"""
+Idempotent bulk ingestion of transactions (bank syncs, CSV uploads).
+
+Rows are matched on their import key (the content fingerprint, numbered
+when identical rows repeat within an upload), so retrying an upload never
+inserts the same transaction twice. Conflicting rows are either skipped or
+upserted (category and tags replaced by the incoming values).
+"""
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import router, transaction
+from django.utils import timezone
+
+from .balances import apply_delta
+from .currency import get_base_currency, rates
+from .fingerprints import import_key, transaction_fingerprint
+from .models import Transaction
+from .signals import sync_tag_ids
+from .versions import touch, user_key
+
+
+SKIP = 'skip'
+UPDATE = 'update'
+ON_CONFLICT_CHOICES = (SKIP, UPDATE)
+
+TransactionTag = Transaction.tags.through
+
+
+def bulk_ingest(user, rows, on_conflict=SKIP):
+    """Insert validated transaction rows for `user`, resolving duplicates.
+
+    `rows` are dicts as produced by `TransactionSerializer.validated_data`;
+    a row may carry its own `import_key` (see `api.fingerprints`). Returns
+    counts of created, updated and skipped rows.
+    """
+    if on_conflict not in ON_CONFLICT_CHOICES:
+        raise ValueError(f"on_conflict must be one of {', '.join(ON_CONFLICT_CHOICES)}")
+
+    # Key incoming rows; identical rows within the batch are numbered, so
+    # they stay separate transactions
+    incoming = {}
+    repeats = defaultdict(int)
+    for row in rows:
+        fingerprint = transaction_fingerprint(
+            user.pk, row['date'], row['type'], row['amount'],
+            row.get('currency', settings.DEFAULT_CURRENCY), row.get('description', '')
+        )
+        key = row.get('import_key')
+        if key is None:
+            key = import_key(fingerprint, repeats[fingerprint])
+            repeats[fingerprint] += 1
+        incoming.setdefault(key, (fingerprint, row))
+    skipped = len(rows) - len(incoming)
+
+    with transaction.atomic(using=router.db_for_write(Transaction)):
+        existing = {
+            obj.import_key: obj
+            for obj in Transaction.objects.filter(user=user, import_key__in=list(incoming))
+        }
+
+        now = timezone.now()
+        new_objects = [
+            Transaction(
+                user=user,
+                amount=row['amount'],
+                currency=row.get('currency', settings.DEFAULT_CURRENCY),
+                type=row['type'],
+                date=row['date'],
+                description=row.get('description', ''),
+                category=row.get('category'),
+                fingerprint=fingerprint,
+                import_key=key,
+            )
+            for key, (fingerprint, row) in incoming.items()
+            if key not in existing
+        ]
+        # ignore_conflicts guards against rows inserted concurrently since
+        # the lookup above
+        Transaction.objects.bulk_create(new_objects, batch_size=1000, ignore_conflicts=True)
+        created = {
+            obj.import_key: obj
+            for obj in Transaction.objects.filter(
+                user=user,
+                import_key__in=[obj.import_key for obj in new_objects],
+            )
+        }
+
+        updated = {}
+        if on_conflict == UPDATE:
+            for key, obj in existing.items():
+                obj.category = incoming[key][1].get('category')
+                obj.updated_at = now
+                updated[key] = obj
+            Transaction.objects.bulk_update(list(updated.values()), ['category', 'updated_at'], batch_size=1000)
+            TransactionTag.objects.filter(transaction_id__in=[obj.pk for obj in updated.values()]).delete()
+        else:
+            skipped += len(existing)
+
+        # Tags for created and upserted rows, then one UPDATE for tag_ids
+        targets = {**created, **updated}
+        TransactionTag.objects.bulk_create(
+            [
+                TransactionTag(transaction_id=obj.pk, tag_id=tag.pk)
+                for key, obj in targets.items()
+                for tag in incoming[key][1].get('tags', [])
+            ],
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+        sync_tag_ids(Transaction.objects.filter(pk__in=[obj.pk for obj in targets.values()]))
+
+        # bulk_create skips signals, so update the daily balances once per day and type
+        base_currency = get_base_currency(user.pk)
+        deltas = defaultdict(int)
+        for obj in created.values():
+            deltas[(obj.date, obj.type)] += rates.convert(obj.amount, obj.currency, base_currency, obj.date)
+        for (date, transaction_type), amount in sorted(deltas.items()):
+            apply_delta(user.pk, date, transaction_type, amount)
+        if created or updated:
+            touch(user_key(user.pk))
+
+    return {
+        'created': len(created),
+        'updated': len(updated),
+        'skipped': skipped,
+    }
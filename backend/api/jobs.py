@@ -0,0 +1,215 @@
+"""
+Database-backed background jobs.
+
+Jobs are rows in the `Job` table. Handlers are registered by name with the
+`job` decorator, enqueued with `enqueue()` and executed by the `run_jobs`
+management command, which claims due jobs and runs them in a process pool.
+No external broker is needed; PostgreSQL and SQLite both work.
+"""
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from accounts.sharding import DEFAULT_DB, ShardMoving, get_user_shard, use_shard
+
+from .models import Job
+
+
+_registry = {}
+_params_schemas = {}
+
+
+def job(name, params=None):
+    """Register a job handler under `name`.
+
+    The handler is called with the `Job` instance and returns a
+    JSON-serializable result, which is stored on the job. `params` is an
+    optional serializer class that validates the job's params when it is
+    enqueued.
+    """
+    def decorator(func):
+        _registry[name] = func
+        if params is not None:
+            _params_schemas[name] = params
+        return func
+    return decorator
+
+
+def get_handler(name):
+    """Return the handler registered under `name`, or None"""
+    return _registry.get(name)
+
+
+def registered_kinds():
+    """Return the names of all registered job handlers"""
+    return sorted(_registry)
+
+
+def validate_params(kind, params):
+    """Validate params with the schema registered for `kind` and return them cleaned.
+
+    Raises rest_framework's ValidationError for invalid params.
+    """
+    params = params or {}
+    schema = _params_schemas.get(kind)
+    if schema is None:
+        return params
+    serializer = schema(data=params)
+    serializer.is_valid(raise_exception=True)
+    # Representation, not validated_data, so dates stay JSON-serializable
+    return dict(serializer.data)
+
+
+def enqueue(kind, user=None, params=None, max_attempts=None, run_at=None):
+    """Create a pending job for the handler registered as `kind`"""
+    if kind not in _registry:
+        raise ValueError(f"Unknown job kind '{kind}'")
+
+    return Job.objects.create(
+        kind=kind,
+        user=user,
+        params=validate_params(kind, params),
+        max_attempts=max_attempts or settings.JOB_MAX_ATTEMPTS,
+        run_at=run_at or timezone.now(),
+    )
+
+
+def claim_jobs(worker_id, limit):
+    """Claim up to `limit` due jobs for `worker_id` and return their ids.
+
+    Candidates are locked with SKIP LOCKED where the database supports it;
+    the status-guarded update makes the claim safe on SQLite as well.
+    """
+    if limit <= 0:
+        return []
+
+    now = timezone.now()
+    claimed = []
+    with transaction.atomic():
+        candidates = list(
+            Job.objects.select_for_update(skip_locked=True)
+            .filter(status=Job.PENDING, run_at__lte=now)
+            .order_by('run_at', 'id')
+            .values_list('id', flat=True)[:limit]
+        )
+        for job_id in candidates:
+            updated = Job.objects.filter(pk=job_id, status=Job.PENDING).update(
+                status=Job.RUNNING,
+                locked_by=worker_id,
+                heartbeat_at=now,
+                started_at=now,
+                attempts=F('attempts') + 1,
+            )
+            if updated:
+                claimed.append(job_id)
+    return claimed
+
+
+def heartbeat_jobs(worker_id, job_ids):
+    """Refresh the heartbeat of jobs this worker is still running"""
+    job_ids = list(job_ids)
+    if not job_ids:
+        return 0
+    return Job.objects.filter(pk__in=job_ids, status=Job.RUNNING, locked_by=worker_id).update(
+        heartbeat_at=timezone.now()
+    )
+
+
+def release_jobs(jobs, error):
+    """Return running jobs whose run was lost to the queue.
+
+    Jobs that have used up their attempts are failed instead, so a job that
+    kills its worker process is not retried forever.
+    """
+    now = timezone.now()
+    jobs = jobs.filter(status=Job.RUNNING)
+    failed = jobs.filter(attempts__gte=F('max_attempts')).update(
+        status=Job.FAILED,
+        locked_by='',
+        error=error,
+        finished_at=now,
+    )
+    requeued = jobs.filter(attempts__lt=F('max_attempts')).update(
+        status=Job.PENDING,
+        locked_by='',
+        error=error,
+        run_at=now,
+    )
+    return failed + requeued
+
+
+def requeue_stale_jobs(timeout=None):
+    """Return running jobs whose worker stopped sending heartbeats to the queue"""
+    timeout = timeout or settings.JOB_LOCK_TIMEOUT
+    cutoff = timezone.now() - timedelta(seconds=timeout)
+    return release_jobs(
+        Job.objects.filter(heartbeat_at__lt=cutoff),
+        f'Worker sent no heartbeat for {timeout} seconds'
+    )
+
+
+def execute_job(job_id):
+    """Run a claimed job and store its result, retrying on failure.
+
+    Results are only stored while this run still holds the claim; a run
+    that was requeued and claimed again meanwhile leaves the job alone.
+    Jobs of a user who is being moved to another shard go back to the
+    queue without using up an attempt.
+    """
+    job = Job.objects.select_related('user').get(pk=job_id)
+    handler = get_handler(job.kind)
+    claim = Job.objects.filter(
+        pk=job.pk, status=Job.RUNNING, locked_by=job.locked_by, attempts=job.attempts
+    )
+
+    try:
+        if handler is None:
+            raise ValueError(f"Unknown job kind '{job.kind}'")
+        if job.user_id:
+            database, moving = get_user_shard(job.user_id)
+        else:
+            database, moving = DEFAULT_DB, False
+        if moving:
+            raise ShardMoving()
+        with use_shard(database):
+            result = handler(job)
+    except ShardMoving:
+        claim.update(
+            status=Job.PENDING,
+            locked_by='',
+            attempts=F('attempts') - 1,
+            run_at=timezone.now() + timedelta(seconds=settings.JOB_RETRY_BACKOFF),
+        )
+        return False
+    except Exception:
+        error = traceback.format_exc()
+        if job.attempts < job.max_attempts:
+            # Exponential backoff before the next attempt
+            delay = settings.JOB_RETRY_BACKOFF * (2 ** (job.attempts - 1))
+            claim.update(
+                status=Job.PENDING,
+                locked_by='',
+                error=error,
+                run_at=timezone.now() + timedelta(seconds=delay),
+            )
+        else:
+            claim.update(
+                status=Job.FAILED,
+                locked_by='',
+                error=error,
+                finished_at=timezone.now(),
+            )
+        return False
+
+    return bool(claim.update(
+        status=Job.SUCCEEDED,
+        locked_by='',
+        progress=100,
+        result=result,
+        error='',
+        finished_at=timezone.now(),
+    ))
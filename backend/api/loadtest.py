@@ -0,0 +1,343 @@
+"""
+Concurrent load generator for the API.
+
+Simulated users register, log in and then loop over a weighted mix of
+dashboard reads, transaction creates, searches and savings-goal deposits,
+either against `config.asgi.application` in-process or against a server on
+a local socket. Latencies are recorded per endpoint and summarised as
+throughput, error rate, throttled (429) rate, percentiles and a histogram.
+
+In-process, the simulated users are concurrent but the API is not: Django
+runs the sync DRF views one at a time on its single thread-sensitive
+executor, so requests queue behind each other. Such runs compare endpoints
+and catch regressions; for capacity figures, point `--url` at a server
+deployed with its real worker count.
+"""
+import asyncio
+import json
+import random
+import time
+import uuid
+from collections import Counter, defaultdict
+from datetime import date, timedelta
+from urllib.parse import urlsplit, urlencode
+
+
+# Upper bounds (ms) of the latency histogram buckets
+HISTOGRAM_BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+# Relative weights of the actions a simulated user picks from
+DEFAULT_MIX = {
+    'dashboard': 40,
+    'create_transaction': 25,
+    'search': 15,
+    'add_amount': 10,
+    'login': 5,
+    'balance_history': 5,
+}
+
+SEARCH_TERMS = ['coffee', 'rent', 'salary', 'groceries', 'fuel', 'gym']
+
+
+class Response:
+    def __init__(self, status, body):
+        self.status = status
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body) if self.body else None
+
+
+class ASGIClient:
+    """Send requests straight to an ASGI application, without a socket"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def request(self, method, path, headers, body=b''):
+        path, _, query_string = path.partition('?')
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': method,
+            'scheme': 'http',
+            'path': path,
+            'raw_path': path.encode(),
+            'query_string': query_string.encode(),
+            'root_path': '',
+            'headers': [(b'host', b'localhost'), (b'content-length', str(len(body)).encode())] + [
+                (name.lower().encode(), value.encode()) for name, value in headers.items()
+            ],
+            'client': ('127.0.0.1', 0),
+            'server': ('localhost', 80),
+        }
+        request_sent = False
+        disconnected = asyncio.Event()
+        status = None
+        chunks = []
+
+        async def receive():
+            nonlocal request_sent
+            if not request_sent:
+                request_sent = True
+                return {'type': 'http.request', 'body': body, 'more_body': False}
+            await disconnected.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            elif message['type'] == 'http.response.body':
+                chunks.append(message.get('body', b''))
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            disconnected.set()
+        return Response(status, b''.join(chunks))
+
+
+class SocketClient:
+    """Minimal HTTP/1.1 client over a local TCP socket, one connection per request"""
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.prefix = parts.path.rstrip('/')
+
+    async def request(self, method, path, headers, body=b''):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        try:
+            lines = [
+                f'{method} {self.prefix}{path} HTTP/1.1',
+                f'Host: {self.host}:{self.port}',
+                'Connection: close',
+                f'Content-Length: {len(body)}',
+            ] + [f'{name}: {value}' for name, value in headers.items()]
+            writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode() + body)
+            await writer.drain()
+            raw = await reader.read()
+        finally:
+            writer.close()
+        head, _, payload = raw.partition(b'\r\n\r\n')
+        status = int(head.split(b' ', 2)[1])
+        if b'transfer-encoding: chunked' in head.lower():
+            payload = _dechunk(payload)
+        return Response(status, payload)
+
+
+def _dechunk(payload):
+    body = b''
+    while payload:
+        size_line, _, payload = payload.partition(b'\r\n')
+        size = int(size_line.split(b';')[0], 16)
+        if size == 0:
+            break
+        body += payload[:size]
+        payload = payload[size + 2:]
+    return body
+
+
+class EndpointStats:
+    def __init__(self):
+        self.latencies = []
+        self.statuses = Counter()
+        self.errors = 0
+        self.throttled = 0
+
+    def record(self, latency_ms, status):
+        self.latencies.append(latency_ms)
+        self.statuses[status] += 1
+        if status == 429:
+            self.throttled += 1
+        elif status is None or status >= 400:
+            self.errors += 1
+
+    def percentile(self, fraction):
+        ordered = sorted(self.latencies)
+        if not ordered:
+            return 0.0
+        index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+        return ordered[index]
+
+    def histogram(self):
+        counts = Counter()
+        for latency in self.latencies:
+            for bound in HISTOGRAM_BUCKETS:
+                if latency <= bound:
+                    counts[f'<={bound}ms'] += 1
+                    break
+            else:
+                counts[f'>{HISTOGRAM_BUCKETS[-1]}ms'] += 1
+        return counts
+
+    def summary(self, elapsed):
+        count = len(self.latencies)
+        return {
+            'requests': count,
+            'throughput': count / elapsed if elapsed else 0.0,
+            'errors': self.errors,
+            'error_rate': self.errors / count if count else 0.0,
+            'throttled': self.throttled,
+            'throttled_rate': self.throttled / count if count else 0.0,
+            'p50': self.percentile(0.50),
+            'p95': self.percentile(0.95),
+            'p99': self.percentile(0.99),
+            'max': max(self.latencies, default=0.0),
+            'statuses': {str(status): n for status, n in sorted(self.statuses.items(), key=str)},
+            'histogram': dict(self.histogram()),
+        }
+
+
+class SimulatedUser:
+    """One client following the configured action mix"""
+
+    def __init__(self, runner, index):
+        self.runner = runner
+        self.client = runner.client
+        self.rng = random.Random(runner.seed + index)
+        self.username = f'{runner.username_prefix}{index}'
+        self.password = f'Lt-{uuid.uuid4().hex}'
+        self.token = None
+        self.goal_id = None
+        self.category_id = None
+        self.counter = 0
+
+    async def call(self, name, method, path, data=None, auth=True):
+        headers = {'Content-Type': 'application/json', 'Accept': 'application/json'}
+        if auth and self.token:
+            headers['Authorization'] = f'Bearer {self.token}'
+        body = json.dumps(data).encode() if data is not None else b''
+
+        start = time.perf_counter()
+        try:
+            response = await self.client.request(method, path, headers, body)
+        except Exception:
+            self.runner.record(name, (time.perf_counter() - start) * 1000, None)
+            return None
+        self.runner.record(name, (time.perf_counter() - start) * 1000, response.status)
+        return response
+
+    async def setup(self):
+        response = await self.call('POST /api/auth/register/', 'POST', '/api/auth/register/', {
+            'username': self.username,
+            'email': f'{self.username}@example.com',
+            'password': self.password,
+        }, auth=False)
+        if response is None or response.status != 201:
+            return False
+        self.token = response.json()['tokens']['access']
+
+        response = await self.call('POST /api/categories/', 'POST', '/api/categories/', {
+            'name': 'Load test', 'type': 'expense',
+        })
+        if response is not None and response.status == 201:
+            self.category_id = response.json()['id']
+
+        response = await self.call('POST /api/savings-goals/', 'POST', '/api/savings-goals/', {
+            'name': 'Load test goal', 'target_amount': '100000.00',
+        })
+        if response is not None and response.status == 201:
+            self.goal_id = response.json()['id']
+        return True
+
+    async def login(self):
+        response = await self.call('POST /api/auth/login/', 'POST', '/api/auth/login/', {
+            'username': self.username, 'password': self.password,
+        }, auth=False)
+        if response is not None and response.status == 200:
+            self.token = response.json()['access']
+
+    async def dashboard(self):
+        await self.call('GET /api/transactions/summary/', 'GET', '/api/transactions/summary/')
+        await self.call('GET /api/transactions/', 'GET', '/api/transactions/?page=1')
+        await self.call('GET /api/budgets/', 'GET', '/api/budgets/')
+        await self.call('GET /api/savings-goals/', 'GET', '/api/savings-goals/')
+
+    async def create_transaction(self):
+        self.counter += 1
+        day = date.today() - timedelta(days=self.rng.randint(0, 365))
+        await self.call('POST /api/transactions/', 'POST', '/api/transactions/', {
+            'amount': f'{self.rng.uniform(1, 500):.2f}',
+            'type': 'expense',
+            'date': day.isoformat(),
+            'description': f'{self.rng.choice(SEARCH_TERMS)} #{self.counter}',
+            'category': self.category_id,
+        })
+
+    async def search(self):
+        query = urlencode({'search': self.rng.choice(SEARCH_TERMS)})
+        await self.call('GET /api/transactions/?search=', 'GET', f'/api/transactions/?{query}')
+
+    async def add_amount(self):
+        if self.goal_id is None:
+            return
+        path = f'/api/savings-goals/{self.goal_id}/add_amount/'
+        await self.call('POST /api/savings-goals/{id}/add_amount/', 'POST', path, {
+            'amount': f'{self.rng.uniform(1, 100):.2f}',
+        })
+
+    async def balance_history(self):
+        await self.call('GET /api/transactions/balance_history/', 'GET', '/api/transactions/balance_history/')
+
+    async def run(self, deadline):
+        if not await self.setup():
+            return
+        actions, weights = zip(*self.runner.mix.items())
+        while time.monotonic() < deadline:
+            action = self.rng.choices(actions, weights)[0]
+            await getattr(self, action)()
+            if self.runner.think_time:
+                await asyncio.sleep(self.rng.expovariate(1 / self.runner.think_time))
+
+
+class LoadTest:
+    """Run `users` simulated users for `duration` seconds and collect stats"""
+
+    def __init__(self, client, users=10, duration=30, ramp_up=0, think_time=0.5,
+                 mix=None, seed=0):
+        self.client = client
+        self.users = users
+        self.duration = duration
+        self.ramp_up = ramp_up
+        self.think_time = think_time
+        self.mix = mix or DEFAULT_MIX
+        self.seed = seed
+        self.username_prefix = f'loadtest_{uuid.uuid4().hex[:8]}_'
+        self.stats = defaultdict(EndpointStats)
+        self.elapsed = 0.0
+
+    def record(self, name, latency_ms, status):
+        self.stats[name].record(latency_ms, status)
+
+    async def _start_user(self, index, deadline):
+        if self.ramp_up and self.users > 1:
+            await asyncio.sleep(self.ramp_up * index / (self.users - 1))
+        await SimulatedUser(self, index).run(deadline)
+
+    async def run(self):
+        start = time.monotonic()
+        deadline = start + self.ramp_up + self.duration
+        await asyncio.gather(*(self._start_user(index, deadline) for index in range(self.users)))
+        self.elapsed = time.monotonic() - start
+        return self.report()
+
+    def report(self):
+        total = EndpointStats()
+        endpoints = {}
+        for name, stats in sorted(self.stats.items()):
+            endpoints[name] = stats.summary(self.elapsed)
+            total.latencies.extend(stats.latencies)
+            total.statuses.update(stats.statuses)
+            total.errors += stats.errors
+            total.throttled += stats.throttled
+        return {
+            'users': self.users,
+            'elapsed': self.elapsed,
+            'username_prefix': self.username_prefix,
+            'total': total.summary(self.elapsed),
+            'endpoints': endpoints,
+        }
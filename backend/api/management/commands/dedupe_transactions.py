@@ -0,0 +1,125 @@
+from collections import defaultdict
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import router, transaction
+
+from accounts.sharding import use_user_shard
+from api.fingerprints import transaction_fingerprint
+from api.models import Transaction
+from api.signals import sync_tag_ids
+
+
+TransactionTag = Transaction.tags.through
+
+
+class Command(BaseCommand):
+    help = (
+        'Fingerprint transactions that have none and report duplicates; '
+        'with --merge, merge them, one user and one short transaction per batch'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user', action='append', dest='users', default=[],
+            help='Username to process (repeatable); defaults to all users'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Number of duplicate groups merged or rows fingerprinted per transaction'
+        )
+        parser.add_argument(
+            '--merge', action='store_true',
+            help='Merge duplicates into the oldest row (identical transactions can be genuine, so check the report first)'
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Report duplicates without changing anything'
+        )
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by('pk')
+        if options['users']:
+            users = users.filter(username__in=options['users'])
+
+        total_merged = 0
+        for user_id, username in users.values_list('pk', 'username').iterator():
+            with use_user_shard(user_id):
+                merged = self.process_user(
+                    user_id, options['batch_size'], options['merge'], options['dry_run']
+                )
+            if merged:
+                self.stdout.write(f'{username}: {merged} duplicates')
+            total_merged += merged
+
+        verb = 'Merged' if options['merge'] and not options['dry_run'] else 'Found'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {total_merged} duplicate transactions'))
+
+    def process_user(self, user_id, batch_size, merge, dry_run):
+        # Group the user's transactions by fingerprint; the oldest row of each
+        # group is kept
+        groups = defaultdict(list)
+        missing = {}
+        rows = (
+            Transaction.objects.filter(user_id=user_id)
+            .order_by('pk')
+            .values_list('pk', 'date', 'type', 'amount', 'currency', 'description', 'fingerprint')
+        )
+        for pk, date, transaction_type, amount, currency, description, stored in rows.iterator(chunk_size=5000):
+            fingerprint = transaction_fingerprint(user_id, date, transaction_type, amount, currency, description)
+            groups[fingerprint].append(pk)
+            if stored != fingerprint:
+                missing[pk] = fingerprint
+
+        duplicate_groups = [pks for pks in groups.values() if len(pks) > 1]
+        merged = sum(len(pks) - 1 for pks in duplicate_groups)
+        if dry_run:
+            return merged
+
+        if merge:
+            for start in range(0, len(duplicate_groups), batch_size):
+                self.merge_groups(duplicate_groups[start:start + batch_size])
+
+        # Store fingerprints of the rows that remain
+        kept = (pks[:1] if merge else pks for pks in groups.values())
+        keepers = [(pk, missing[pk]) for pks in kept for pk in pks if pk in missing]
+        for start in range(0, len(keepers), batch_size):
+            with transaction.atomic(using=router.db_for_write(Transaction)):
+                Transaction.objects.bulk_update(
+                    [Transaction(pk=pk, fingerprint=fingerprint) for pk, fingerprint in keepers[start:start + batch_size]],
+                    ['fingerprint']
+                )
+        return merged
+
+    def merge_groups(self, groups):
+        """Move tags and import keys of duplicate rows onto the kept row, then
+        delete the duplicates"""
+        keeper_of = {pk: pks[0] for pks in groups for pk in pks[1:]}
+        with transaction.atomic(using=router.db_for_write(Transaction)):
+            # A kept row without an import key takes over a duplicate's, so
+            # retrying the upload that stored the duplicate still matches it
+            import_keys = dict(
+                Transaction.objects.filter(pk__in=[pk for pks in groups for pk in pks], import_key__isnull=False)
+                .values_list('pk', 'import_key')
+            )
+            adopted_keys = []
+            for pks in groups:
+                if pks[0] in import_keys:
+                    continue
+                key = next((import_keys[pk] for pk in pks[1:] if pk in import_keys), None)
+                if key is not None:
+                    adopted_keys.append(Transaction(pk=pks[0], import_key=key))
+
+            tag_links = TransactionTag.objects.filter(transaction_id__in=list(keeper_of))
+            TransactionTag.objects.bulk_create(
+                [
+                    TransactionTag(transaction_id=keeper_of[transaction_id], tag_id=tag_id)
+                    for transaction_id, tag_id in tag_links.values_list('transaction_id', 'tag_id')
+                ],
+                ignore_conflicts=True,
+            )
+            # Deleting through the ORM fires post_delete, which keeps the
+            # daily balance series correct
+            Transaction.objects.filter(pk__in=list(keeper_of)).delete()
+            Transaction.objects.bulk_update(adopted_keys, ['import_key'])
+            sync_tag_ids(Transaction.objects.filter(pk__in=[pks[0] for pks in groups]))
@@ -0,0 +1,55 @@
+import csv
+from datetime import date
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from api.currency import rates_changed
+from api.models import ExchangeRate
+from api.versions import RATES, touch
+
+
+class Command(BaseCommand):
+    help = (
+        'Load exchange rates from a CSV file with date,currency,rate columns, where rate is '
+        'units of FX_PIVOT_CURRENCY per unit of currency. Existing rates are overwritten. '
+        'Run rebuild_balances afterwards if historical rates changed.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV file to load')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows written per query')
+
+    def handle(self, *args, **options):
+        rows = []
+        try:
+            with open(options['path'], newline='') as f:
+                for line, record in enumerate(csv.DictReader(f), start=2):
+                    try:
+                        rows.append({
+                            'currency': record['currency'].strip().upper(),
+                            'date': date.fromisoformat(record['date'].strip()),
+                            'rate': Decimal(record['rate'].strip()),
+                        })
+                    except (KeyError, ValueError, InvalidOperation) as e:
+                        raise CommandError(f'Line {line}: invalid row ({e})')
+        except OSError as e:
+            raise CommandError(str(e))
+
+        # Rates are reference data joined into every shard's aggregates,
+        # so each shard holds a full copy. bulk_create sets pks and state on
+        # the instances it saves, so each database gets its own
+        for database in settings.SHARD_DATABASES:
+            with transaction.atomic(using=database):
+                ExchangeRate.objects.using(database).bulk_create(
+                    [ExchangeRate(**row) for row in rows],
+                    batch_size=options['batch_size'],
+                    update_conflicts=True,
+                    unique_fields=['currency', 'date'],
+                    update_fields=['rate', 'updated_at'],
+                )
+                touch(RATES, using=database)
+        rates_changed()
+        self.stdout.write(self.style.SUCCESS(f'Loaded {len(rows)} exchange rates'))
@@ -0,0 +1,122 @@
+import asyncio
+import json
+from contextlib import nullcontext
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from api.loadtest import ASGIClient, DEFAULT_MIX, HISTOGRAM_BUCKETS, LoadTest, SocketClient
+
+
+class Command(BaseCommand):
+    help = (
+        'Drive the API with concurrent simulated users and report throughput, '
+        'latency percentiles and error rates per endpoint'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10, help='Number of concurrent simulated users')
+        parser.add_argument('--duration', type=float, default=30, help='Seconds to run after ramp-up')
+        parser.add_argument('--ramp-up', type=float, default=0, help='Seconds over which users are started')
+        parser.add_argument('--think-time', type=float, default=0.5, help='Mean pause between actions in seconds')
+        parser.add_argument(
+            '--url',
+            help='Base URL of a running server (e.g. http://127.0.0.1:8000); '
+                 'defaults to calling config.asgi.application in-process, where views '
+                 'run one at a time, so use a deployed server to measure capacity. The '
+                 "server's own throttle rates apply, so raise its THROTTLE_RATE_* settings"
+        )
+        parser.add_argument(
+            '--throttle', action='store_true',
+            help='Keep API throttling on for in-process runs (off by default, since '
+                 'all simulated users share one client address)'
+        )
+        parser.add_argument(
+            '--mix', type=json.loads,
+            help=f'JSON object of action weights, default {json.dumps(DEFAULT_MIX)}'
+        )
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for the action mix')
+        parser.add_argument('--json', dest='json_path', help='Also write the full report to this file')
+        parser.add_argument(
+            '--histogram', action='store_true',
+            help='Print the latency histogram of every endpoint'
+        )
+        parser.add_argument(
+            '--keep-users', action='store_true',
+            help='Keep the simulated users and their data instead of deleting them afterwards'
+        )
+
+    def handle(self, *args, **options):
+        if options['mix'] and set(options['mix']) - set(DEFAULT_MIX):
+            raise CommandError(f"Unknown actions in --mix; choose from {', '.join(DEFAULT_MIX)}")
+
+        if options['url']:
+            client = SocketClient(options['url'])
+        else:
+            from config.asgi import application
+            client = ASGIClient(application)
+
+        load_test = LoadTest(
+            client,
+            users=options['users'],
+            duration=options['duration'],
+            ramp_up=options['ramp_up'],
+            think_time=options['think_time'],
+            mix=options['mix'],
+            seed=options['seed'],
+        )
+        throttling = override_settings(REST_FRAMEWORK={
+            **settings.REST_FRAMEWORK,
+            'DEFAULT_THROTTLE_RATES': {scope: None for scope in settings.REST_FRAMEWORK['DEFAULT_THROTTLE_RATES']},
+        })
+        if options['url'] or options['throttle']:
+            throttling = nullcontext()
+        try:
+            with throttling:
+                report = asyncio.run(load_test.run())
+        finally:
+            if not options['keep_users']:
+                User.objects.filter(username__startswith=load_test.username_prefix).delete()
+
+        self.print_report(report, options['histogram'])
+        if not options['url']:
+            self.stdout.write(self.style.WARNING(
+                '\nIn-process run: sync views were served one at a time, so throughput '
+                'is that of a single worker thread. Use --url against a deployed server '
+                'to measure concurrent capacity.'
+            ))
+        if options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump(report, f, indent=2)
+
+    def print_report(self, report, show_histogram):
+        self.stdout.write(f"{report['users']} users, {report['elapsed']:.1f}s\n")
+        header = (
+            f"{'endpoint':<44} {'reqs':>7} {'req/s':>8} {'err%':>6} {'429%':>6} "
+            f"{'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}"
+        )
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        rows = list(report['endpoints'].items()) + [('TOTAL', report['total'])]
+        for name, stats in rows:
+            self.stdout.write(
+                f"{name:<44} {stats['requests']:>7} {stats['throughput']:>8.1f} "
+                f"{stats['error_rate'] * 100:>6.1f} {stats['throttled_rate'] * 100:>6.1f} "
+                f"{stats['p50']:>7.1f}ms {stats['p95']:>7.1f}ms "
+                f"{stats['p99']:>7.1f}ms {stats['max']:>7.1f}ms"
+            )
+
+        buckets = [f'<={bound}ms' for bound in HISTOGRAM_BUCKETS] + [f'>{HISTOGRAM_BUCKETS[-1]}ms']
+        histograms = rows if show_histogram else [('TOTAL', report['total'])]
+        for name, stats in histograms:
+            self.stdout.write(f'\nLatency histogram: {name}')
+            peak = max(stats['histogram'].values(), default=0)
+            for bucket in buckets:
+                count = stats['histogram'].get(bucket, 0)
+                bar = '#' * (40 * count // peak if peak else 0)
+                self.stdout.write(f'{bucket:>9} {count:>7} {bar}')
+
+        statuses = ', '.join(f'{status}: {n}' for status, n in report['total']['statuses'].items())
+        self.stdout.write(f'\nStatus codes: {statuses}')
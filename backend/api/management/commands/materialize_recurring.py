@@ -0,0 +1,36 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from accounts.sharding import get_user_shard, use_shard
+from api.recurring import due_rules, materialize_due
+
+
+class Command(BaseCommand):
+    help = 'Store recurring transaction occurrences that are due as transactions (run daily)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user', action='append', dest='users', default=[],
+            help='Username to process (repeatable); defaults to all users with due rules'
+        )
+
+    def handle(self, *args, **options):
+        today = timezone.now().date()
+        usernames = set(options['users'])
+        total = 0
+        for database in settings.SHARD_DATABASES:
+            with use_shard(database):
+                user_ids = list(due_rules(today).values_list('user_id', flat=True).distinct())
+                for user in User.objects.filter(pk__in=user_ids).order_by('pk'):
+                    if usernames and user.username not in usernames:
+                        continue
+                    # Skip users whose data is being moved off this shard
+                    if get_user_shard(user.pk) != (database, False):
+                        continue
+                    counts = materialize_due(user, today)
+                    if counts['created']:
+                        self.stdout.write(f"{user.username}: {counts['created']} transactions")
+                    total += counts['created']
+        self.stdout.write(self.style.SUCCESS(f'Created {total} recurring transactions'))
@@ -0,0 +1,26 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from accounts.sharding import use_user_shard
+from api.balances import rebuild_balances
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the materialized daily balance series from transactions'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user', action='append', dest='users', default=[],
+            help='Username to rebuild (repeatable); defaults to all users'
+        )
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by('pk')
+        if options['users']:
+            users = users.filter(username__in=options['users'])
+
+        for user_id, username in users.values_list('pk', 'username').iterator():
+            with use_user_shard(user_id):
+                days = rebuild_balances(user_id)
+            self.stdout.write(f'{username}: {days} days')
+        self.stdout.write(self.style.SUCCESS('Daily balances rebuilt'))
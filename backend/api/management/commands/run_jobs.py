@@ -0,0 +1,107 @@
+import os
+import socket
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from api.jobs import claim_jobs, execute_job, heartbeat_jobs, release_jobs, requeue_stale_jobs
+from api.models import Job
+
+
+def _init_worker():
+    """Set up Django in a pool process without sharing the parent's connections"""
+    import django
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+    django.setup()
+    connections.close_all()
+
+
+def _run(job_id):
+    try:
+        return execute_job(job_id)
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = 'Run background jobs from the database queue in a process pool'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=settings.JOB_WORKERS,
+            help='Number of worker processes'
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=settings.JOB_POLL_INTERVAL,
+            help='Seconds to wait between polls when the queue is empty'
+        )
+        parser.add_argument(
+            '--burst', action='store_true',
+            help='Exit once no due jobs remain instead of polling forever'
+        )
+
+    def handle(self, *args, **options):
+        workers = max(1, options['workers'])
+        poll_interval = options['poll_interval']
+        worker_id = f'{socket.gethostname()}:{os.getpid()}'
+
+        self.stdout.write(f'Starting job worker {worker_id} with {workers} processes')
+        running = {}
+        pool = self.create_pool(workers)
+        try:
+            while True:
+                # The worker heartbeats for its processes, so long handlers
+                # that never report progress are not requeued as stale
+                heartbeat_jobs(worker_id, running.values())
+                requeue_stale_jobs()
+                for job_id in claim_jobs(worker_id, workers - len(running)):
+                    try:
+                        future = pool.submit(_run, job_id)
+                    except BrokenProcessPool:
+                        pool = self.restart_pool(pool, workers)
+                        future = pool.submit(_run, job_id)
+                    running[future] = job_id
+
+                if not running:
+                    if options['burst']:
+                        break
+                    time.sleep(poll_interval)
+                    continue
+
+                done, _ = wait(running, timeout=poll_interval, return_when=FIRST_COMPLETED)
+                broken = False
+                for future in done:
+                    job_id = running.pop(future)
+                    try:
+                        succeeded = future.result()
+                    except Exception as e:
+                        self.stderr.write(f'Job {job_id} crashed: {e!r}')
+                        release_jobs(
+                            Job.objects.filter(pk=job_id, locked_by=worker_id),
+                            f'Worker process crashed: {e!r}'
+                        )
+                        broken = broken or isinstance(e, BrokenProcessPool)
+                        continue
+                    outcome = 'succeeded' if succeeded else 'failed'
+                    self.stdout.write(f'Job {job_id} {outcome}')
+                if broken:
+                    pool = self.restart_pool(pool, workers)
+        except KeyboardInterrupt:
+            self.stdout.write('Stopping job worker')
+        finally:
+            pool.shutdown(wait=True)
+
+    def create_pool(self, workers):
+        # Forked pool processes must not inherit open database connections
+        connections.close_all()
+        return ProcessPoolExecutor(max_workers=workers, initializer=_init_worker)
+
+    def restart_pool(self, pool, workers):
+        """Replace a pool whose worker process died"""
+        self.stderr.write('Process pool is broken; starting a new one')
+        pool.shutdown(wait=False, cancel_futures=True)
+        return self.create_pool(workers)
@@ -0,0 +1,34 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from accounts.sharding import use_shard
+from api.models import Transaction
+from api.signals import sync_tag_ids
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the denormalized Transaction.tag_ids column from the tags table'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help='Number of transactions updated per query'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        total = 0
+        for database in settings.SHARD_DATABASES:
+            with use_shard(database):
+                last_pk = 0
+                while True:
+                    pks = list(
+                        Transaction.objects.filter(pk__gt=last_pk)
+                        .order_by('pk')
+                        .values_list('pk', flat=True)[:batch_size]
+                    )
+                    if not pks:
+                        break
+                    total += sync_tag_ids(Transaction.objects.filter(pk__in=pks))
+                    last_pk = pks[-1]
+        self.stdout.write(self.style.SUCCESS(f'Synced tag_ids for {total} transactions'))
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:52
+
+import api.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='tag_ids',
+            field=api.fields.IdArrayField(base_field=models.BigIntegerField(), blank=True, default=list, editable=False, help_text='Denormalized copy of tags, kept in sync by api.signals', size=None),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=api.fields.PortableGinIndex(fields=['tag_ids'], name='api_transac_tag_ids_983c8a_gin'),
+        ),
+    ]
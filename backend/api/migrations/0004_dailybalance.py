@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:52
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_transaction_tag_ids'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyBalance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('income', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('expenses', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('net', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('balance', models.DecimalField(decimal_places=2, default=Decimal('0.00'), help_text='Cumulative net of all transactions up to and including this date', max_digits=14)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_balances', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['user', 'date'],
+                'constraints': [models.UniqueConstraint(fields=('user', 'date'), name='unique_daily_balance')],
+            },
+        ),
+    ]
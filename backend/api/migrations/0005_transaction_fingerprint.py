@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:56
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_dailybalance'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='fingerprint',
+            field=models.CharField(blank=True, db_index=True, editable=False, help_text='Content hash of user, date, type, amount, currency and normalized description', max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='import_key',
+            field=models.CharField(blank=True, editable=False, help_text='Identity of a row stored by bulk ingestion, unique per user; empty for manual entries', max_length=64, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='transaction',
+            constraint=models.UniqueConstraint(condition=models.Q(('import_key__isnull', False)), fields=('user', 'import_key'), name='unique_transaction_import_key'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:40
+
+import api.models
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_transaction_fingerprint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExchangeRate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('currency', models.CharField(max_length=3, validators=[django.core.validators.RegexValidator('^[A-Z]{3}$', 'Enter a three-letter ISO 4217 currency code.')])),
+                ('date', models.DateField()),
+                ('rate', models.DecimalField(decimal_places=10, help_text='Units of the pivot currency per unit of this currency', max_digits=20)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['currency', '-date'],
+                'constraints': [models.UniqueConstraint(fields=('currency', 'date'), name='unique_exchange_rate')],
+            },
+        ),
+        migrations.AddField(
+            model_name='budget',
+            name='currency',
+            field=models.CharField(default=api.models.default_currency, help_text='ISO 4217 currency code', max_length=3, validators=[django.core.validators.RegexValidator('^[A-Z]{3}$', 'Enter a three-letter ISO 4217 currency code.')]),
+        ),
+        migrations.AddField(
+            model_name='savingsgoal',
+            name='currency',
+            field=models.CharField(default=api.models.default_currency, help_text='ISO 4217 currency code', max_length=3, validators=[django.core.validators.RegexValidator('^[A-Z]{3}$', 'Enter a three-letter ISO 4217 currency code.')]),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='currency',
+            field=models.CharField(default=api.models.default_currency, help_text='ISO 4217 currency code', max_length=3, validators=[django.core.validators.RegexValidator('^[A-Z]{3}$', 'Enter a three-letter ISO 4217 currency code.')]),
+        ),
+    ]
@@ -1,7 +1,21 @@
-from django.db import models
+from django.db import models, router, transaction
 from django.contrib.auth.models import User
-from django.core.validators import MinValueValidator
+from django.conf import settings
+from django.core.validators import MinValueValidator, RegexValidator
+from django.utils import timezone
 from decimal import Decimal
+from .fields import IdArrayField, PortableGinIndex
+from .fingerprints import transaction_fingerprint
+
+
+currency_code_validator = RegexValidator(
+    r'^[A-Z]{3}$',
+    'Enter a three-letter ISO 4217 currency code.'
+)
+
+
+def default_currency():
+    return settings.DEFAULT_CURRENCY
 
 
 class Category(models.Model):
@@ -58,6 +72,12 @@ class Transaction(models.Model):
         decimal_places=2,
         validators=[MinValueValidator(Decimal('0.01'))]
     )
+    currency = models.CharField(
+        max_length=3,
+        default=default_currency,
+        validators=[currency_code_validator],
+        help_text='ISO 4217 currency code'
+    )
     type = models.CharField(max_length=10, choices=TYPE_CHOICES)
     date = models.DateField()
     description = models.TextField(blank=True)
@@ -68,6 +88,28 @@ class Transaction(models.Model):
         related_name='transactions'
     )
     tags = models.ManyToManyField(Tag, blank=True, related_name='transactions')
+    tag_ids = IdArrayField(
+        models.BigIntegerField(),
+        default=list,
+        blank=True,
+        editable=False,
+        help_text='Denormalized copy of tags, kept in sync by api.signals'
+    )
+    fingerprint = models.CharField(
+        max_length=64,
+        null=True,
+        blank=True,
+        editable=False,
+        db_index=True,
+        help_text='Content hash of user, date, type, amount, currency and normalized description'
+    )
+    import_key = models.CharField(
+        max_length=64,
+        null=True,
+        blank=True,
+        editable=False,
+        help_text='Identity of a row stored by bulk ingestion, unique per user; empty for manual entries'
+    )
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='transactions')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -77,12 +119,100 @@ class Transaction(models.Model):
         indexes = [
             models.Index(fields=['-date', 'user']),
             models.Index(fields=['type', 'user']),
+            PortableGinIndex(fields=['tag_ids']),
         ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'import_key'],
+                condition=models.Q(import_key__isnull=False),
+                name='unique_transaction_import_key'
+            ),
+        ]
+    
+    def compute_fingerprint(self):
+        """Return the content fingerprint for the current field values"""
+        return transaction_fingerprint(
+            self.user_id, self.date, self.type, self.amount, self.currency, self.description
+        )
+    
+    def save(self, *args, **kwargs):
+        self.fingerprint = self.compute_fingerprint()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = set(update_fields) | {'fingerprint'}
+        # The post_save balance update runs in the same transaction as the
+        # row itself, so a failure rolls both back
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using):
+            super().save(*args, **kwargs)
     
     def __str__(self):
         return f"{self.get_type_display()}: {self.amount} - {self.date}"
 
 
+class RecurringRule(models.Model):
+    """Repeating transaction (rent, salary, subscriptions).
+    
+    Occurrences are expanded on demand (see api.recurring) and stored as
+    `Transaction` rows only once they are due.
+    """
+    DAILY = 'daily'
+    WEEKLY = 'weekly'
+    MONTHLY = 'monthly'
+    YEARLY = 'yearly'
+    FREQUENCY_CHOICES = [
+        (DAILY, 'Daily'),
+        (WEEKLY, 'Weekly'),
+        (MONTHLY, 'Monthly'),
+        (YEARLY, 'Yearly'),
+    ]
+    
+    amount = models.DecimalField(
+        max_digits=12,
+        decimal_places=2,
+        validators=[MinValueValidator(Decimal('0.01'))]
+    )
+    currency = models.CharField(
+        max_length=3,
+        default=default_currency,
+        validators=[currency_code_validator],
+        help_text='ISO 4217 currency code'
+    )
+    type = models.CharField(max_length=10, choices=Transaction.TYPE_CHOICES)
+    description = models.TextField(blank=True)
+    category = models.ForeignKey(
+        Category,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='recurring_rules'
+    )
+    tags = models.ManyToManyField(Tag, blank=True, related_name='recurring_rules')
+    frequency = models.CharField(max_length=10, choices=FREQUENCY_CHOICES, default=MONTHLY)
+    interval = models.PositiveSmallIntegerField(
+        default=1,
+        validators=[MinValueValidator(1)],
+        help_text='Repeat every N days, weeks, months or years'
+    )
+    start_date = models.DateField(help_text='Date of the first occurrence')
+    end_date = models.DateField(null=True, blank=True, help_text='No occurrences after this date')
+    materialized_until = models.DateField(
+        null=True,
+        blank=True,
+        editable=False,
+        help_text='Occurrences up to this date are stored as transactions'
+    )
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='recurring_rules')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['start_date', 'created_at']
+    
+    def __str__(self):
+        return f"{self.get_frequency_display()} {self.get_type_display()}: {self.amount} from {self.start_date}"
+
+
 class Budget(models.Model):
     """Monthly or periodic budgets for categories"""
     MONTHLY = 'monthly'
@@ -103,6 +233,12 @@ class Budget(models.Model):
         decimal_places=2,
         validators=[MinValueValidator(Decimal('0.01'))]
     )
+    currency = models.CharField(
+        max_length=3,
+        default=default_currency,
+        validators=[currency_code_validator],
+        help_text='ISO 4217 currency code'
+    )
     period = models.CharField(max_length=10, choices=PERIOD_CHOICES, default=MONTHLY)
     year = models.IntegerField()
     month = models.IntegerField(null=True, blank=True, help_text='Required for monthly budgets')
@@ -135,6 +271,12 @@ class SavingsGoal(models.Model):
         default=Decimal('0.00'),
         validators=[MinValueValidator(Decimal('0.00'))]
     )
+    currency = models.CharField(
+        max_length=3,
+        default=default_currency,
+        validators=[currency_code_validator],
+        help_text='ISO 4217 currency code'
+    )
     deadline = models.DateField(null=True, blank=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='savings_goals')
     created_at = models.DateTimeField(auto_now_add=True)
@@ -157,3 +299,116 @@ class SavingsGoal(models.Model):
     
     def __str__(self):
         return f"{self.name} - {self.current_amount}/{self.target_amount}"
+
+
+class Job(models.Model):
+    """Background job executed by the `run_jobs` worker"""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    ]
+    
+    kind = models.CharField(max_length=100, help_text='Registered job handler name')
+    params = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    progress = models.PositiveSmallIntegerField(default=0, help_text='Progress percentage (0-100)')
+    progress_message = models.CharField(max_length=255, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_at = models.DateTimeField(default=timezone.now, help_text='Earliest time the job may run')
+    locked_by = models.CharField(max_length=100, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='jobs'
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'run_at']),
+            models.Index(fields=['user', '-created_at']),
+        ]
+    
+    def set_progress(self, progress, message=''):
+        """Record progress and refresh the worker heartbeat"""
+        self.progress = max(0, min(100, int(progress)))
+        self.progress_message = message[:255]
+        self.heartbeat_at = timezone.now()
+        Job.objects.filter(pk=self.pk).update(
+            progress=self.progress,
+            progress_message=self.progress_message,
+            heartbeat_at=self.heartbeat_at,
+        )
+    
+    def __str__(self):
+        return f"Job {self.pk}: {self.kind} ({self.get_status_display()})"
+
+
+class DailyBalance(models.Model):
+    """Materialized per-user daily income, expenses and running balance"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='daily_balances')
+    date = models.DateField()
+    income = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    expenses = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    net = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    balance = models.DecimalField(
+        max_digits=14,
+        decimal_places=2,
+        default=Decimal('0.00'),
+        help_text='Cumulative net of all transactions up to and including this date'
+    )
+    
+    class Meta:
+        ordering = ['user', 'date']
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'date'], name='unique_daily_balance'),
+        ]
+    
+    def __str__(self):
+        return f"{self.user} {self.date}: {self.balance}"
+
+
+class ExchangeRate(models.Model):
+    """Daily exchange rate of a currency against settings.FX_PIVOT_CURRENCY"""
+    currency = models.CharField(max_length=3, validators=[currency_code_validator])
+    date = models.DateField()
+    rate = models.DecimalField(
+        max_digits=20,
+        decimal_places=10,
+        help_text='Units of the pivot currency per unit of this currency'
+    )
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['currency', '-date']
+        constraints = [
+            models.UniqueConstraint(fields=['currency', 'date'], name='unique_exchange_rate'),
+        ]
+    
+    def __str__(self):
+        return f"{self.currency} {self.date}: {self.rate}"
+
+
+class DataVersion(models.Model):
+    """Token that changes whenever the data behind a cache changes (see api.versions)"""
+    key = models.CharField(max_length=64, unique=True)
+    token = models.CharField(max_length=32)
+    
+    def __str__(self):
+        return f"{self.key}: {self.token}"
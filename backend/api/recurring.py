@@ -0,0 +1,216 @@
+"""
+Recurring transactions.
+
+A `RecurringRule` stands for every occurrence of a repeating transaction.
+Occurrences that are not stored yet are expanded on demand for the date
+range a request asks about and returned as unsaved `Transaction` objects,
+which `MergedTransactions` interleaves with stored rows in list order.
+
+`materialize_due` stores occurrences once they are due (through
+`bulk_ingest`, so fingerprints, tags and daily balances stay consistent) and
+advances the rule's `materialized_until`, so the transaction table never
+holds future rows.
+"""
+import calendar
+import heapq
+from datetime import date, timedelta
+from functools import cmp_to_key
+from itertools import islice
+
+from django.db import router, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .balances import ZERO
+from .currency import rates
+from .fingerprints import occurrence_key
+from .ingest import SKIP, bulk_ingest
+from .models import RecurringRule, Transaction
+
+
+# Occurrences are never expanded further ahead than this
+HORIZON_DAYS = 3660
+
+
+def nth_occurrence(rule, n):
+    """Date of the rule's n-th occurrence (0 is the start date).
+
+    Monthly and yearly rules keep the start date's day of month, clamped to
+    the length of shorter months.
+    """
+    start = rule.start_date
+    step = n * rule.interval
+    if rule.frequency == RecurringRule.DAILY:
+        return start + timedelta(days=step)
+    if rule.frequency == RecurringRule.WEEKLY:
+        return start + timedelta(weeks=step)
+
+    months = step * 12 if rule.frequency == RecurringRule.YEARLY else step
+    month_index = start.month - 1 + months
+    year = start.year + month_index // 12
+    month = month_index % 12 + 1
+    return date(year, month, min(start.day, calendar.monthrange(year, month)[1]))
+
+
+def _first_index(rule, start):
+    """Index of the first occurrence on or after `start`"""
+    if start <= rule.start_date:
+        return 0
+    if rule.frequency in (RecurringRule.DAILY, RecurringRule.WEEKLY):
+        period = rule.interval * (7 if rule.frequency == RecurringRule.WEEKLY else 1)
+        return -(-(start - rule.start_date).days // period)
+
+    period = rule.interval * (12 if rule.frequency == RecurringRule.YEARLY else 1)
+    months = (start.year - rule.start_date.year) * 12 + start.month - rule.start_date.month
+    n = months // period
+    while nth_occurrence(rule, n) < start:
+        n += 1
+    return n
+
+
+def occurrence_dates(rule, start_date, end_date):
+    """Dates on which `rule` occurs in [start_date, end_date], in order"""
+    horizon = timezone.now().date() + timedelta(days=HORIZON_DAYS)
+    end_date = min(end_date, horizon)
+    if rule.end_date:
+        end_date = min(end_date, rule.end_date)
+
+    n = _first_index(rule, start_date or rule.start_date)
+    while True:
+        day = nth_occurrence(rule, n)
+        if day > end_date:
+            return
+        yield day
+        n += 1
+
+
+def pending_from(rule, start_date=None):
+    """First date from which the rule's occurrences are not stored yet"""
+    if rule.materialized_until and (start_date is None or rule.materialized_until >= start_date):
+        return rule.materialized_until + timedelta(days=1)
+    return start_date
+
+
+def pending_occurrences(rules, start_date, end_date):
+    """Unsaved transactions for occurrences of `rules` in [start_date, end_date] not stored yet.
+
+    `rules` should select `category` and prefetch `tags`. Each occurrence
+    carries the id of its rule as `recurring_rule_id`.
+    """
+    occurrences = []
+    for rule in rules:
+        tag_ids = sorted(tag.pk for tag in rule.tags.all())
+        for day in occurrence_dates(rule, pending_from(rule, start_date), end_date):
+            occurrence = Transaction(
+                user_id=rule.user_id,
+                amount=rule.amount,
+                currency=rule.currency,
+                type=rule.type,
+                date=day,
+                description=rule.description,
+                category=rule.category,
+                tag_ids=tag_ids,
+            )
+            occurrence.recurring_rule_id = rule.pk
+            occurrences.append(occurrence)
+    return occurrences
+
+
+def occurrence_totals(occurrences, currency):
+    """Income and expense totals of occurrences, converted to `currency`"""
+    totals = {Transaction.INCOME: ZERO, Transaction.EXPENSE: ZERO}
+    for occurrence in occurrences:
+        totals[occurrence.type] += rates.convert(
+            occurrence.amount, occurrence.currency, currency, occurrence.date
+        )
+    return totals
+
+
+class MergedTransactions:
+    """Stored transactions and pending occurrences as one ordered sequence.
+
+    Supports count(), len() and slicing, so DRF pagination works unchanged;
+    a page only fetches the stored rows up to its own end.
+    """
+
+    def __init__(self, queryset, occurrences, ordering):
+        self.queryset = queryset
+        self.ordering = ordering
+        self.key = cmp_to_key(self.compare)
+        self.occurrences = sorted(occurrences, key=self.key)
+
+    def compare(self, a, b):
+        """Compare two transactions by the list ordering (unsaved rows sort as newest)"""
+        for field in self.ordering:
+            name = field.lstrip('-')
+            left, right = getattr(a, name), getattr(b, name)
+            if left == right:
+                continue
+            if left is None or right is None:
+                result = 1 if left is None else -1
+            else:
+                result = -1 if left < right else 1
+            return -result if field.startswith('-') else result
+        return 0
+
+    def count(self):
+        return self.queryset.count() + len(self.occurrences)
+
+    def __len__(self):
+        return self.count()
+
+    def __iter__(self):
+        return heapq.merge(self.queryset, self.occurrences, key=self.key)
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        start, stop = index.start or 0, index.stop
+        stored = self.queryset if stop is None else self.queryset[:stop]
+        merged = heapq.merge(stored, self.occurrences, key=self.key)
+        return list(islice(merged, start, stop))
+
+
+def due_rules(today):
+    """Rules with occurrences due by `today` that are not stored yet"""
+    return (
+        RecurringRule.objects.filter(start_date__lte=today)
+        .filter(Q(materialized_until__isnull=True) | Q(materialized_until__lt=today))
+        .exclude(end_date__lte=F('materialized_until'))
+    )
+
+
+def materialize_due(user, today=None):
+    """Store `user`'s occurrences that are due by `today` as transactions.
+
+    Returns `bulk_ingest` counts. Each occurrence is keyed by its rule and
+    date, so a rerun skips the ones already stored while identical rules
+    still get a transaction each.
+    """
+    today = today or timezone.now().date()
+    rules = list(
+        due_rules(today).filter(user=user)
+        .select_related('category')
+        .prefetch_related('tags')
+    )
+    rows = []
+    for rule in rules:
+        tags = list(rule.tags.all())
+        for day in occurrence_dates(rule, pending_from(rule), today):
+            rows.append({
+                'amount': rule.amount,
+                'currency': rule.currency,
+                'type': rule.type,
+                'date': day,
+                'description': rule.description,
+                'category': rule.category,
+                'tags': tags,
+                'import_key': occurrence_key(rule.pk, day),
+            })
+
+    counts = {'created': 0, 'updated': 0, 'skipped': 0}
+    with transaction.atomic(using=router.db_for_write(RecurringRule)):
+        if rows:
+            counts = bulk_ingest(user, rows, on_conflict=SKIP)
+        RecurringRule.objects.filter(pk__in=[rule.pk for rule in rules]).update(materialized_until=today)
+    return counts
@@ -1,21 +1,59 @@
 from rest_framework import serializers
+from django.conf import settings
 from django.contrib.auth.models import User
-from .models import Category, Tag, Transaction, Budget, SavingsGoal
+from django.utils import timezone
+from accounts.models import Profile
+import calendar
+from datetime import date
+from .models import Category, Tag, Transaction, RecurringRule, Budget, SavingsGoal, Job, currency_code_validator
+from .currency import converted_amount, get_base_currency, rates, validate_convertible_currency
+from .jobs import registered_kinds, validate_params
+from .fingerprints import transaction_fingerprint
+from .recurring import occurrence_dates, occurrence_totals, pending_from, pending_occurrences
+
+
+class BaseCurrencyMixin:
+    """Look up each user's base currency once per serialization"""
+    
+    def get_user_base_currency(self, user_id):
+        cache = self.context.setdefault('_base_currencies', {})
+        if user_id not in cache:
+            cache[user_id] = get_base_currency(user_id)
+        return cache[user_id]
+
+
+class ConvertibleCurrencyMixin:
+    """Only accept currencies that exchange rates are loaded for"""
+    
+    def validate_currency(self, value):
+        # Checked once per currency, so bulk uploads don't query per row
+        checked = self.context.setdefault('_convertible_currencies', set())
+        if value not in checked:
+            validate_convertible_currency(value)
+            checked.add(value)
+        return value
 
 
 class UserSerializer(serializers.ModelSerializer):
     """User serializer for registration and profile"""
     password = serializers.CharField(write_only=True, required=True, style={'input_type': 'password'})
+    base_currency = serializers.CharField(
+        source='profile.base_currency',
+        max_length=3,
+        required=False,
+        validators=[currency_code_validator, validate_convertible_currency]
+    )
     
     class Meta:
         model = User
-        fields = ('id', 'username', 'email', 'password', 'first_name', 'last_name')
+        fields = ('id', 'username', 'email', 'password', 'first_name', 'last_name', 'base_currency')
         extra_kwargs = {
             'password': {'write_only': True},
             'email': {'required': True}
         }
     
     def create(self, validated_data):
+        profile_data = validated_data.pop('profile', {})
         user = User.objects.create_user(
             username=validated_data['username'],
             email=validated_data.get('email', ''),
@@ -23,7 +61,18 @@ class UserSerializer(serializers.ModelSerializer):
             first_name=validated_data.get('first_name', ''),
             last_name=validated_data.get('last_name', ''),
         )
+        Profile.objects.create(user=user, **profile_data)
         return user
+    
+    def update(self, instance, validated_data):
+        profile_data = validated_data.pop('profile', None)
+        instance = super().update(instance, validated_data)
+        if profile_data:
+            profile, _ = Profile.objects.get_or_create(user=instance)
+            for attr, value in profile_data.items():
+                setattr(profile, attr, value)
+            profile.save()
+        return instance
 
 
 class CategorySerializer(serializers.ModelSerializer):
@@ -46,23 +95,79 @@ class TagSerializer(serializers.ModelSerializer):
         read_only_fields = ('created_at',)
 
 
-class TransactionSerializer(serializers.ModelSerializer):
+class TagIdsField(serializers.ManyRelatedField):
+    """Writable tags relation that reads from the denormalized `tag_ids` column"""
+    
+    def get_attribute(self, instance):
+        # Unsaved recurring occurrences carry their rule's tags in tag_ids too
+        return instance.tag_ids
+    
+    def to_representation(self, iterable):
+        return list(iterable)
+
+
+class TransactionSerializer(BaseCurrencyMixin, ConvertibleCurrencyMixin, serializers.ModelSerializer):
     """Transaction serializer"""
     category_name = serializers.CharField(source='category.name', read_only=True)
     category_color = serializers.CharField(source='category.color', read_only=True)
+    tags = TagIdsField(
+        child_relation=serializers.PrimaryKeyRelatedField(queryset=Tag.objects.all()),
+        required=False
+    )
     tags_list = serializers.SerializerMethodField()
+    base_amount = serializers.SerializerMethodField()
+    recurring_rule = serializers.SerializerMethodField()
     
     class Meta:
         model = Transaction
         fields = (
-            'id', 'amount', 'type', 'date', 'description', 
+            'id', 'amount', 'currency', 'base_amount', 'type', 'date', 'description', 
             'category', 'category_name', 'category_color',
-            'tags', 'tags_list', 'created_at', 'updated_at'
+            'tags', 'tags_list', 'recurring_rule', 'created_at', 'updated_at'
         )
         read_only_fields = ('created_at', 'updated_at')
     
+    def get_recurring_rule(self, obj):
+        """Rule id of an occurrence that is not stored yet (id is then null)"""
+        return getattr(obj, 'recurring_rule_id', None)
+    
+    def get_base_amount(self, obj):
+        """Amount in the user's base currency, from the in-process rate cache"""
+        base_currency = self.get_user_base_currency(obj.user_id)
+        return float(rates.convert(obj.amount, obj.currency, base_currency, obj.date))
+    
+    def get_tag_names(self, user_id):
+        """Map of tag id to name for a user, loaded once per serialization"""
+        cache = self.context.setdefault('_tag_names', {})
+        if user_id not in cache:
+            cache[user_id] = dict(Tag.objects.filter(user_id=user_id).values_list('id', 'name'))
+        return cache[user_id]
+    
     def get_tags_list(self, obj):
-        return [tag.name for tag in obj.tags.all()]
+        names = self.get_tag_names(obj.user_id)
+        return sorted(names[tag_id] for tag_id in obj.tag_ids if tag_id in names)
+    
+    def find_duplicate(self, data):
+        """Return an existing transaction with the same content fingerprint, if any"""
+        instance = self.instance
+        request = self.context.get('request')
+        user = instance.user if instance else getattr(request, 'user', None)
+        if user is None or not user.is_authenticated:
+            return None
+        
+        def value(name, default=''):
+            if name in data:
+                return data[name]
+            return getattr(instance, name) if instance else default
+        
+        fingerprint = transaction_fingerprint(
+            user.pk, value('date'), value('type'), value('amount'),
+            value('currency', settings.DEFAULT_CURRENCY), value('description')
+        )
+        duplicates = Transaction.objects.filter(user=user, fingerprint=fingerprint)
+        if instance:
+            duplicates = duplicates.exclude(pk=instance.pk)
+        return duplicates.first()
     
     def validate(self, data):
         """Validate that category type matches transaction type"""
@@ -74,10 +179,59 @@ class TransactionSerializer(serializers.ModelSerializer):
                 f"Category '{category.name}' is for {category.type} transactions, "
                 f"but this is an {transaction_type} transaction."
             )
+        
+        # Duplicates are only rejected when asked for (on_conflict=error);
+        # skip/update resolve them after validation
+        if self.context.get('on_conflict') == 'error':
+            duplicate = self.find_duplicate(data)
+            if duplicate:
+                raise serializers.ValidationError(
+                    f"Duplicate of transaction {duplicate.pk} with the same date, "
+                    f"type, amount and description.",
+                    code='duplicate'
+                )
+        return data
+
+
+class RecurringRuleSerializer(ConvertibleCurrencyMixin, serializers.ModelSerializer):
+    """Recurring transaction rule serializer"""
+    category_name = serializers.CharField(source='category.name', read_only=True)
+    tags = serializers.PrimaryKeyRelatedField(many=True, queryset=Tag.objects.all(), required=False)
+    next_occurrence = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = RecurringRule
+        fields = (
+            'id', 'amount', 'currency', 'type', 'description', 'category', 'category_name',
+            'tags', 'frequency', 'interval', 'start_date', 'end_date',
+            'materialized_until', 'next_occurrence', 'created_at', 'updated_at'
+        )
+        read_only_fields = ('materialized_until', 'created_at', 'updated_at')
+    
+    def get_next_occurrence(self, obj):
+        """Date of the next occurrence that is not stored yet, if any"""
+        today = timezone.now().date()
+        start_date = pending_from(obj, today)
+        return next(occurrence_dates(obj, start_date, date.max), None)
+    
+    def validate(self, data):
+        """Validate the category type and the date range"""
+        category = data.get('category', getattr(self.instance, 'category', None))
+        rule_type = data.get('type', getattr(self.instance, 'type', None))
+        if category and category.type != rule_type:
+            raise serializers.ValidationError(
+                f"Category '{category.name}' is for {category.type} transactions, "
+                f"but this is an {rule_type} rule."
+            )
+        
+        start_date = data.get('start_date', getattr(self.instance, 'start_date', None))
+        end_date = data.get('end_date', getattr(self.instance, 'end_date', None))
+        if start_date and end_date and end_date < start_date:
+            raise serializers.ValidationError({'end_date': 'End date must not be before the start date.'})
         return data
 
 
-class BudgetSerializer(serializers.ModelSerializer):
+class BudgetSerializer(ConvertibleCurrencyMixin, serializers.ModelSerializer):
     """Budget serializer"""
     category_name = serializers.CharField(source='category.name', read_only=True)
     spent_amount = serializers.SerializerMethodField()
@@ -87,16 +241,33 @@ class BudgetSerializer(serializers.ModelSerializer):
     class Meta:
         model = Budget
         fields = (
-            'id', 'category', 'category_name', 'amount', 'period', 
+            'id', 'category', 'category_name', 'amount', 'currency', 'period', 
             'year', 'month', 'spent_amount', 'remaining_amount', 
             'progress_percentage', 'created_at', 'updated_at'
         )
         read_only_fields = ('created_at', 'updated_at')
     
+    def get_expense_rules(self, user_id):
+        """A user's expense rules, loaded once per serialization"""
+        cache = self.context.setdefault('_expense_rules', {})
+        if user_id not in cache:
+            cache[user_id] = list(
+                RecurringRule.objects.filter(user_id=user_id, type=Transaction.EXPENSE)
+                .select_related('category')
+                .prefetch_related('tags')
+            )
+        return cache[user_id]
+    
     def get_spent_amount(self, obj):
-        """Calculate spent amount for this budget period"""
+        """Calculate spent amount for this budget period, in the budget's currency.
+        
+        Includes occurrences of recurring expenses not stored yet.
+        """
         from django.db.models import Sum
-        from datetime import date
+        
+        cache = self.context.setdefault('_spent_amounts', {})
+        if obj.pk in cache:
+            return cache[obj.pk]
         
         transactions = Transaction.objects.filter(
             user=obj.user,
@@ -104,12 +275,20 @@ class BudgetSerializer(serializers.ModelSerializer):
             type='expense',
             date__year=obj.year
         )
+        start_date, end_date = date(obj.year, 1, 1), date(obj.year, 12, 31)
         
         if obj.period == Budget.MONTHLY and obj.month:
             transactions = transactions.filter(date__month=obj.month)
+            start_date = date(obj.year, obj.month, 1)
+            end_date = date(obj.year, obj.month, calendar.monthrange(obj.year, obj.month)[1])
         
-        spent = transactions.aggregate(Sum('amount'))['amount__sum'] or 0
-        return float(spent)
+        spent = transactions.aggregate(spent=Sum(converted_amount(obj.currency)))['spent'] or 0
+        rules = [rule for rule in self.get_expense_rules(obj.user_id) if rule.category_id == obj.category_id]
+        spent += occurrence_totals(
+            pending_occurrences(rules, start_date, end_date), obj.currency
+        )[Transaction.EXPENSE]
+        cache[obj.pk] = float(spent)
+        return cache[obj.pk]
     
     def get_remaining_amount(self, obj):
         """Calculate remaining budget amount"""
@@ -121,20 +300,75 @@ class BudgetSerializer(serializers.ModelSerializer):
         spent = self.get_spent_amount(obj)
         if obj.amount == 0:
             return 0
-        return min(100, (spent / obj.amount) * 100)
+        return min(100, (spent / float(obj.amount)) * 100)
 
 
-class SavingsGoalSerializer(serializers.ModelSerializer):
+class SavingsGoalSerializer(BaseCurrencyMixin, ConvertibleCurrencyMixin, serializers.ModelSerializer):
     """Savings goal serializer"""
     progress_percentage = serializers.FloatField(read_only=True)
     remaining_amount = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
+    base_currency = serializers.SerializerMethodField()
+    base_target_amount = serializers.SerializerMethodField()
+    base_current_amount = serializers.SerializerMethodField()
     
     class Meta:
         model = SavingsGoal
         fields = (
-            'id', 'name', 'target_amount', 'current_amount', 
+            'id', 'name', 'target_amount', 'current_amount', 'currency',
             'deadline', 'progress_percentage', 'remaining_amount',
+            'base_currency', 'base_target_amount', 'base_current_amount',
             'created_at', 'updated_at'
         )
         read_only_fields = ('created_at', 'updated_at')
+    
+    def get_base_currency(self, obj):
+        return self.get_user_base_currency(obj.user_id)
+    
+    def to_base(self, obj, amount):
+        """Convert at today's rate with the in-process rate cache"""
+        today = timezone.now().date()
+        return float(rates.convert(amount, obj.currency, self.get_user_base_currency(obj.user_id), today))
+    
+    def get_base_target_amount(self, obj):
+        return self.to_base(obj, obj.target_amount)
+    
+    def get_base_current_amount(self, obj):
+        return self.to_base(obj, obj.current_amount)
 
+
+class JobSerializer(serializers.ModelSerializer):
+    """Background job serializer"""
+    
+    class Meta:
+        model = Job
+        fields = (
+            'id', 'kind', 'params', 'status', 'progress', 'progress_message',
+            'result', 'error', 'attempts', 'max_attempts', 'run_at',
+            'started_at', 'finished_at', 'created_at', 'updated_at'
+        )
+        read_only_fields = (
+            'status', 'progress', 'progress_message', 'result', 'error',
+            'attempts', 'max_attempts', 'run_at', 'started_at', 'finished_at',
+            'created_at', 'updated_at'
+        )
+    
+    def validate_kind(self, value):
+        """Only registered job handlers can be enqueued"""
+        if value not in registered_kinds():
+            raise serializers.ValidationError(f"Unknown job kind '{value}'.")
+        return value
+    
+    def validate(self, data):
+        """Check params against the schema registered for the job kind"""
+        try:
+            data['params'] = validate_params(data['kind'], data.get('params'))
+        except serializers.ValidationError as e:
+            raise serializers.ValidationError({'params': e.detail})
+        return data
+
+
+class JobListSerializer(JobSerializer):
+    """Job serializer for lists; results can be large, so only the detail view has them"""
+    
+    class Meta(JobSerializer.Meta):
+        fields = tuple(field for field in JobSerializer.Meta.fields if field != 'result')
@@ -0,0 +1,216 @@
+"""
+Signal handlers that keep denormalized data and caches in sync.
+"""
+import contextvars
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.postgres.expressions import ArraySubquery
+from django.contrib.auth.models import User
+from django.contrib.postgres.fields import ArrayField
+from django.db import transaction
+from django.db.models import BigIntegerField, F, Func, OuterRef, Value
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from accounts.models import Profile
+from accounts.sharding import use_user_shard
+
+from .balances import apply_delta, rebuild_balances
+from .fields import has_native_arrays
+from .currency import get_base_currency, rates, rates_changed
+from .models import Budget, Category, ExchangeRate, SavingsGoal, Tag, Transaction
+from .versions import RATES, touch, user_key
+
+
+TransactionTag = Transaction.tags.through
+
+_balance_updates_suspended = contextvars.ContextVar('balance_updates_suspended', default=False)
+
+
+@contextmanager
+def balance_updates_suspended():
+    """Skip balance updates for transactions deleted in this block.
+
+    For callers that drop a user's whole series themselves, where updating
+    it once per deleted transaction would be wasted work.
+    """
+    token = _balance_updates_suspended.set(True)
+    try:
+        yield
+    finally:
+        _balance_updates_suspended.reset(token)
+
+
+def sync_tag_ids(transactions):
+    """Recompute `tag_ids` from the M2M table for a transaction queryset"""
+    if has_native_arrays(transactions.db):
+        return transactions.update(
+            tag_ids=ArraySubquery(
+                TransactionTag.objects
+                .filter(transaction_id=OuterRef('pk'))
+                .order_by('tag_id')
+                .values('tag_id')
+            )
+        )
+
+    # No array subqueries: collect the lists in Python and write them back
+    pks = list(transactions.values_list('pk', flat=True))
+    tag_ids = defaultdict(list)
+    links = (
+        TransactionTag.objects.using(transactions.db)
+        .filter(transaction_id__in=pks)
+        .order_by('tag_id')
+        .values_list('transaction_id', 'tag_id')
+    )
+    for transaction_id, tag_id in links:
+        tag_ids[transaction_id].append(tag_id)
+    Transaction.objects.using(transactions.db).bulk_update(
+        [Transaction(pk=pk, tag_ids=tag_ids[pk]) for pk in pks], ['tag_ids'], batch_size=500
+    )
+    return len(pks)
+
+
+@receiver(m2m_changed, sender=TransactionTag)
+def transaction_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """Mirror changes to `Transaction.tags` into `Transaction.tag_ids`"""
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            instance.tag_ids = sorted(instance.tags.values_list('pk', flat=True))
+            Transaction.objects.filter(pk=instance.pk).update(tag_ids=instance.tag_ids)
+        return
+
+    # Changed from the tag side: pk_set holds transaction ids
+    if action == 'pre_clear':
+        instance._cleared_transaction_ids = list(
+            instance.transactions.values_list('pk', flat=True)
+        )
+    elif action == 'post_clear':
+        transaction_ids = getattr(instance, '_cleared_transaction_ids', [])
+        sync_tag_ids(Transaction.objects.filter(pk__in=transaction_ids))
+    elif action in ('post_add', 'post_remove'):
+        sync_tag_ids(Transaction.objects.filter(pk__in=pk_set))
+
+
+@receiver(pre_delete, sender=Tag)
+def remember_tagged_transactions(sender, instance, **kwargs):
+    """Without array operators, find the tagged rows before the M2M links go"""
+    if not has_native_arrays(instance._state.db):
+        instance._tagged_transaction_ids = list(
+            TransactionTag.objects.using(instance._state.db)
+            .filter(tag_id=instance.pk)
+            .values_list('transaction_id', flat=True)
+        )
+
+
+@receiver(post_delete, sender=Tag)
+def tag_deleted(sender, instance, **kwargs):
+    """Drop a deleted tag from every transaction that referenced it"""
+    if not has_native_arrays(instance._state.db):
+        transaction_ids = getattr(instance, '_tagged_transaction_ids', [])
+        sync_tag_ids(Transaction.objects.using(instance._state.db).filter(pk__in=transaction_ids))
+        return
+    Transaction.objects.filter(tag_ids__contains=[instance.pk]).update(
+        tag_ids=Func(
+            F('tag_ids'),
+            Value(instance.pk),
+            function='array_remove',
+            output_field=ArrayField(BigIntegerField())
+        )
+    )
+
+
+def to_base_currency(user_id, amount, currency, date):
+    """Convert an amount into the user's base currency with the in-process rate cache"""
+    return rates.convert(amount, currency, get_base_currency(user_id), date)
+
+
+@receiver(pre_save, sender=Transaction)
+def remember_balance_fields(sender, instance, **kwargs):
+    """Keep the stored date/type/amount so post_save can reverse them"""
+    instance._previous_balance_fields = None
+    if instance.pk:
+        instance._previous_balance_fields = (
+            Transaction.objects.select_for_update().filter(pk=instance.pk)
+            .values_list('user_id', 'date', 'type', 'amount', 'currency')
+            .first()
+        )
+
+
+@receiver(post_save, sender=Transaction)
+def transaction_saved(sender, instance, created, **kwargs):
+    """Update the daily balance series for a created or edited transaction"""
+    current = (instance.user_id, instance.date, instance.type, instance.amount, instance.currency)
+    previous = getattr(instance, '_previous_balance_fields', None)
+    if previous == current:
+        return
+    if previous:
+        user_id, date, transaction_type, amount, currency = previous
+        apply_delta(user_id, date, transaction_type, -to_base_currency(user_id, amount, currency, date))
+    user_id, date, transaction_type, amount, currency = current
+    apply_delta(user_id, date, transaction_type, to_base_currency(user_id, amount, currency, date))
+
+
+@receiver(post_delete, sender=Transaction)
+def transaction_deleted(sender, instance, **kwargs):
+    """Remove a deleted transaction from the daily balance series"""
+    origin = kwargs.get('origin')
+    if isinstance(origin, User) or getattr(origin, 'model', None) is User:
+        # The user's series is deleted along with them; updating it would
+        # recreate rows for a user that no longer exists
+        return
+    if _balance_updates_suspended.get():
+        return
+    amount = to_base_currency(instance.user_id, instance.amount, instance.currency, instance.date)
+    apply_delta(instance.user_id, instance.date, instance.type, -amount)
+
+
+@receiver(post_save, sender=Transaction)
+@receiver(post_delete, sender=Transaction)
+@receiver(post_save, sender=Budget)
+@receiver(post_delete, sender=Budget)
+@receiver(post_save, sender=SavingsGoal)
+@receiver(post_delete, sender=SavingsGoal)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def forecast_input_changed(sender, instance, **kwargs):
+    """New version for the forecast of the row's user"""
+    origin = kwargs.get('origin')
+    if isinstance(origin, User) or getattr(origin, 'model', None) is User:
+        return
+    touch(user_key(instance.user_id), using=instance._state.db)
+
+
+@receiver(pre_save, sender=Profile)
+def remember_base_currency(sender, instance, **kwargs):
+    instance._previous_base_currency = (
+        Profile.objects.filter(pk=instance.pk).values_list('base_currency', flat=True).first()
+        if instance.pk else None
+    )
+
+
+@receiver(post_save, sender=Profile)
+def profile_saved(sender, instance, created, **kwargs):
+    """Re-convert balances when the base currency changes.
+
+    The rebuild runs before the save returns, rather than as a job, so the
+    series is never read or updated in the old currency under the new one.
+    """
+    # Users without a profile had their series in the default currency
+    previous = settings.DEFAULT_CURRENCY if created else getattr(instance, '_previous_base_currency', None)
+    if previous and previous != instance.base_currency:
+        def rebuild():
+            with use_user_shard(instance.user_id):
+                rebuild_balances(instance.user_id)
+                # Forecasts are in the base currency too
+                touch(user_key(instance.user_id))
+        transaction.on_commit(rebuild, using=kwargs.get('using'))
+
+
+@receiver(post_save, sender=ExchangeRate)
+@receiver(post_delete, sender=ExchangeRate)
+def exchange_rate_changed(sender, instance, **kwargs):
+    """Reload the in-process rate caches"""
+    touch(RATES, using=instance._state.db)
+    rates_changed()
@@ -0,0 +1,119 @@
+"""
+Job handlers for heavy reports and exports.
+
+Handlers are registered with `api.jobs.job` and run by the `run_jobs` worker.
+"""
+from django.db.models import Sum, Count
+from django.db.models.functions import ExtractMonth
+from rest_framework import serializers
+
+from .balances import rebuild_balances
+from .currency import converted_amount, get_base_currency
+from .jobs import job
+from .models import Transaction
+from .recurring import materialize_due
+
+
+class YearlyReportParams(serializers.Serializer):
+    year = serializers.IntegerField(min_value=1900, max_value=2100)
+
+
+@job('yearly_report', params=YearlyReportParams)
+def yearly_report(job):
+    """Monthly income and expense totals per category for one year"""
+    year = int(job.params['year'])
+    transactions = Transaction.objects.filter(user=job.user, date__year=year)
+
+    currency = get_base_currency(job.user_id)
+    rows = (
+        transactions
+        .annotate(month=ExtractMonth('date'))
+        .values('month', 'type', 'category__name')
+        .annotate(total=Sum(converted_amount(currency)), count=Count('id'))
+        .order_by('month', 'type', 'category__name')
+    )
+
+    months = {month: {'income': 0.0, 'expenses': 0.0, 'categories': []} for month in range(1, 13)}
+    for row in rows:
+        month = months[row['month']]
+        total = float(row['total'])
+        if row['type'] == Transaction.INCOME:
+            month['income'] += total
+        else:
+            month['expenses'] += total
+        month['categories'].append({
+            'category': row['category__name'],
+            'type': row['type'],
+            'total': total,
+            'count': row['count'],
+        })
+
+    report = []
+    for number, month in months.items():
+        month['month'] = number
+        month['balance'] = month['income'] - month['expenses']
+        report.append(month)
+
+    return {
+        'year': year,
+        'currency': currency,
+        'total_income': sum(month['income'] for month in report),
+        'total_expenses': sum(month['expenses'] for month in report),
+        'months': report,
+    }
+
+
+class ExportParams(serializers.Serializer):
+    start_date = serializers.DateField(required=False)
+    end_date = serializers.DateField(required=False)
+
+    def validate(self, data):
+        if data.get('start_date') and data.get('end_date') and data['start_date'] > data['end_date']:
+            raise serializers.ValidationError('start_date must not be after end_date')
+        return data
+
+
+@job('export_transactions', params=ExportParams)
+def export_transactions(job):
+    """Export the user's transactions, optionally limited to a date range"""
+    transactions = Transaction.objects.filter(user=job.user)
+    start_date = job.params.get('start_date')
+    end_date = job.params.get('end_date')
+    if start_date:
+        transactions = transactions.filter(date__gte=start_date)
+    if end_date:
+        transactions = transactions.filter(date__lte=end_date)
+
+    total = transactions.count()
+    rows = []
+    values = transactions.order_by('date', 'id').values_list(
+        'id', 'date', 'type', 'amount', 'currency', 'category__name', 'description'
+    )
+    for index, (pk, date, type_, amount, currency, category, description) in enumerate(
+        values.iterator(chunk_size=2000), start=1
+    ):
+        rows.append({
+            'id': pk,
+            'date': date.isoformat(),
+            'type': type_,
+            'amount': str(amount),
+            'currency': currency,
+            'category': category,
+            'description': description,
+        })
+        if index % 2000 == 0:
+            job.set_progress(index * 100 // total, f'{index} of {total} rows')
+
+    return {'count': len(rows), 'rows': rows}
+
+
+@job('rebuild_balances')
+def rebuild_balances_job(job):
+    """Recompute the user's materialized daily balance series"""
+    return {'days': rebuild_balances(job.user_id)}
+
+
+@job('materialize_recurring')
+def materialize_recurring(job):
+    """Store the user's recurring occurrences that are due as transactions"""
+    return materialize_due(job.user)
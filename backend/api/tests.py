@@ -1,3 +1,782 @@
-from django.test import TestCase
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from io import StringIO
+from types import SimpleNamespace
 
-# Create your tests here.
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from accounts.models import Profile, UserShard
+from accounts.sharding import shard_for_user, use_user_shard
+from .balances import balance_series, rebuild_balances
+from .currency import rates_version
+from .forecasting import (
+    _month_index, build_forecast, forecast_budgets, forecast_savings_goals, load_history, project_series
+)
+from .ingest import bulk_ingest
+from .jobs import claim_jobs, enqueue, execute_job, heartbeat_jobs, job, release_jobs, requeue_stale_jobs
+from .models import Budget, Category, DailyBalance, ExchangeRate, Job, RecurringRule, SavingsGoal, Tag, Transaction
+from .recurring import (
+    MergedTransactions, materialize_due, nth_occurrence, occurrence_dates, pending_from, pending_occurrences
+)
+from .signals import balance_updates_suspended
+from .throttling import LocalBucketStore, ScopedTokenBucketThrottle, reset_bucket_store
+
+
+@job('test_flaky')
+def flaky_job(job):
+    """Fails unless its params say otherwise"""
+    if job.params.get('requeued'):
+        # Stand-in for a run that was requeued and claimed by another
+        # worker while this one was still going
+        Job.objects.filter(pk=job.pk).update(locked_by='w2', attempts=job.attempts + 1)
+    if job.params.get('fail', True):
+        raise RuntimeError('flaky')
+    return {'ok': True}
+
+
+@override_settings(JOB_RETRY_BACKOFF=10, JOB_LOCK_TIMEOUT=60)
+class JobQueueTests(TestCase):
+    """Claiming, retrying and releasing queued jobs"""
+
+    databases = '__all__'
+
+    def setUp(self):
+        self.user = User.objects.create_user('jobs', password='secret-password')
+
+    def enqueue(self, **kwargs):
+        return enqueue('test_flaky', user=self.user, **kwargs)
+
+    def state(self, job):
+        job.refresh_from_db()
+        return job.status, job.attempts, job.locked_by
+
+    def test_claim_jobs(self):
+        later = self.enqueue(run_at=timezone.now() + timedelta(hours=1))
+        second = self.enqueue(run_at=timezone.now() - timedelta(seconds=1))
+        first = self.enqueue(run_at=timezone.now() - timedelta(seconds=2))
+        third = self.enqueue()
+
+        self.assertEqual(claim_jobs('w1', 2), [first.pk, second.pk])
+        self.assertEqual(self.state(first), (Job.RUNNING, 1, 'w1'))
+        # Claimed and future jobs are not handed out again
+        self.assertEqual(claim_jobs('w2', 5), [third.pk])
+        self.assertEqual(claim_jobs('w3', 5), [])
+        self.assertEqual(self.state(later), (Job.PENDING, 0, ''))
+
+    def test_retry_with_backoff_then_fail(self):
+        queued = self.enqueue(max_attempts=3)
+        for attempt, backoff in ((1, 10), (2, 20)):
+            claim_jobs('w1', 1)
+            before = timezone.now()
+            self.assertFalse(execute_job(queued.pk))
+            self.assertEqual(self.state(queued), (Job.PENDING, attempt, ''))
+            self.assertIn('RuntimeError: flaky', queued.error)
+            delay = (queued.run_at - before).total_seconds()
+            self.assertAlmostEqual(delay, backoff, delta=1)
+            Job.objects.filter(pk=queued.pk).update(run_at=timezone.now())
+
+        claim_jobs('w1', 1)
+        self.assertFalse(execute_job(queued.pk))
+        self.assertEqual(self.state(queued), (Job.FAILED, 3, ''))
+        self.assertIsNotNone(queued.finished_at)
+
+    def test_success_stores_result(self):
+        queued = self.enqueue(params={'fail': False})
+        claim_jobs('w1', 1)
+        self.assertTrue(execute_job(queued.pk))
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.progress, queued.result), (Job.SUCCEEDED, 100, {'ok': True}))
+
+    def test_lost_claim_keeps_result_out(self):
+        queued = self.enqueue(params={'fail': False, 'requeued': True})
+        claim_jobs('w1', 1)
+        self.assertFalse(execute_job(queued.pk))
+        self.assertEqual(self.state(queued), (Job.RUNNING, 2, 'w2'))
+        self.assertIsNone(queued.result)
+
+    def test_moving_user_requeues(self):
+        queued = self.enqueue(params={'fail': False}, max_attempts=1)
+        UserShard.objects.filter(user=self.user).update(moving=True)
+        claim_jobs('w1', 1)
+        before = timezone.now()
+        self.assertFalse(execute_job(queued.pk))
+        # Back in the queue after the backoff, without using up its one attempt
+        self.assertEqual(self.state(queued), (Job.PENDING, 0, ''))
+        self.assertAlmostEqual((queued.run_at - before).total_seconds(), 10, delta=1)
+
+        UserShard.objects.filter(user=self.user).update(moving=False)
+        Job.objects.filter(pk=queued.pk).update(run_at=timezone.now())
+        claim_jobs('w1', 1)
+        self.assertTrue(execute_job(queued.pk))
+        self.assertEqual(self.state(queued), (Job.SUCCEEDED, 1, ''))
+
+    def test_release_jobs(self):
+        retried = self.enqueue(max_attempts=2)
+        spent = self.enqueue(max_attempts=1)
+        claim_jobs('w1', 2)
+        released = release_jobs(Job.objects.filter(pk__in=[retried.pk, spent.pk]), 'worker died')
+        self.assertEqual(released, 2)
+        self.assertEqual(self.state(retried), (Job.PENDING, 1, ''))
+        self.assertEqual(self.state(spent), (Job.FAILED, 1, ''))
+        self.assertEqual(spent.error, 'worker died')
+
+    def test_requeue_stale_jobs(self):
+        stale = self.enqueue()
+        alive = self.enqueue()
+        claim_jobs('w1', 2)
+        Job.objects.filter(pk=stale.pk).update(heartbeat_at=timezone.now() - timedelta(seconds=120))
+        heartbeat_jobs('w1', [alive.pk])
+        self.assertEqual(requeue_stale_jobs(), 1)
+        self.assertEqual(self.state(stale), (Job.PENDING, 1, ''))
+        self.assertEqual(self.state(alive), (Job.RUNNING, 1, 'w1'))
+
+
+class ThrottlingTests(TestCase):
+    """Token buckets and the scope each request is throttled in"""
+
+    databases = '__all__'
+
+    def setUp(self):
+        reset_bucket_store()
+
+    def test_bucket_refills_up_to_capacity(self):
+        store = LocalBucketStore()
+        self.assertEqual([store.consume('key', 2, 1.0, 0) for _ in range(3)], [0, 0, 1.0])
+        self.assertEqual(store.consume('key', 2, 1.0, 0.5), 0.5)
+        self.assertEqual(store.consume('key', 2, 1.0, 1.5), 0)
+        # A long pause refills the bucket to capacity, no further
+        self.assertEqual([store.consume('key', 2, 1.0, 100) for _ in range(3)], [0, 0, 1.0])
+        self.assertEqual(store.consume('other', 2, 1.0, 100), 0)
+
+    def test_least_recently_used_bucket_is_evicted(self):
+        store = LocalBucketStore(max_entries=2)
+        store.consume('a', 1, 1.0, 0)
+        store.consume('b', 1, 1.0, 0)
+        store.consume('c', 1, 1.0, 0)
+        # 'a' was evicted, so its bucket starts full again
+        self.assertEqual(store.consume('a', 1, 1.0, 0), 0)
+        self.assertGreater(store.consume('c', 1, 1.0, 0), 0)
+
+    def test_scope_selection(self):
+        throttle = ScopedTokenBucketThrottle()
+        scopes = {'search': 'search', 'bulk': 'import'}
+
+        def scope(action, query_params=None, **attrs):
+            view = SimpleNamespace(action=action, throttle_scopes=scopes, **attrs)
+            return throttle.get_scope(SimpleNamespace(query_params=query_params or {}), view)
+
+        self.assertEqual(scope('bulk'), 'import')
+        self.assertEqual(scope('list', {'search': 'rent'}), 'search')
+        self.assertEqual(scope('list'), 'crud')
+        self.assertEqual(scope('retrieve', {'search': 'rent'}), 'crud')
+        self.assertEqual(scope('create', throttle_scope='summary'), 'summary')
+
+    def test_requests_over_the_rate_get_429(self):
+        user = User.objects.create_user('throttled', password='secret-password')
+        client = APIClient()
+        client.force_authenticate(user)
+        rates = {**settings.REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'], 'crud': '2/min', 'search': '1/min'}
+        with override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': rates}):
+            statuses = [client.get('/api/categories/').status_code for _ in range(3)]
+            self.assertEqual(statuses, [200, 200, 429])
+            # Searches are counted in their own scope
+            statuses = [client.get('/api/transactions/?search=rent').status_code for _ in range(2)]
+            self.assertEqual(statuses, [200, 429])
+
+
+class AdminTests(TestCase):
+    """Changelists of large tables run a fixed number of queries"""
+
+    databases = '__all__'
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'secret-password')
+        # The admin works on default; keep the user's data there
+        UserShard.objects.filter(user=self.admin).update(database='default')
+        self.client.force_login(self.admin)
+        self.food = Category.objects.create(user=self.admin, name='Food', type=Category.EXPENSE)
+
+    def add(self, count):
+        for day in range(1, count + 1):
+            Transaction.objects.create(
+                user=self.admin, amount=Decimal('5.00'), type=Transaction.EXPENSE,
+                date=date(2024, 1, day), description='lunch', category=self.food
+            )
+
+    def test_transaction_changelist_queries(self):
+        # Session, user, count and one page of rows with category and user
+        # joined in, however many rows there are
+        self.add(2)
+        with self.assertNumQueries(4):
+            self.assertEqual(self.client.get('/admin/api/transaction/').status_code, 200)
+        self.add(20)
+        with self.assertNumQueries(4):
+            self.assertEqual(self.client.get('/admin/api/transaction/').status_code, 200)
+
+    def test_exchange_rates_read_only(self):
+        rate = ExchangeRate.objects.create(currency='EUR', date=date(2024, 1, 1), rate=Decimal('1.1'))
+        self.assertEqual(self.client.get('/admin/api/exchangerate/').status_code, 200)
+        self.assertEqual(self.client.get('/admin/api/exchangerate/add/').status_code, 403)
+        response = self.client.post(f'/admin/api/exchangerate/{rate.pk}/change/', {
+            'currency': 'EUR', 'date': '2024-01-01', 'rate': '2',
+        })
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.client.get(f'/admin/api/exchangerate/{rate.pk}/delete/').status_code, 403)
+
+
+class TagTests(TestCase):
+    """Tag filters and the denormalized tag_ids column"""
+
+    databases = '__all__'
+
+    def setUp(self):
+        self.user = User.objects.create_user('tags', password='secret-password')
+        shard = use_user_shard(self.user.pk)
+        shard.__enter__()
+        self.addCleanup(shard.__exit__, None, None, None)
+        self.work, self.travel, self.food = (
+            Tag.objects.create(user=self.user, name=name) for name in ('work', 'travel', 'food')
+        )
+        self.taxi = self.add('taxi', self.work, self.travel)
+        self.train = self.add('train', self.travel)
+        self.lunch = self.add('lunch', self.food)
+        self.rent = self.add('rent')
+        reset_bucket_store()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def add(self, description, *tags):
+        transaction = Transaction.objects.create(
+            user=self.user, amount=Decimal('10.00'), type=Transaction.EXPENSE,
+            date=date(2024, 1, 1), description=description
+        )
+        transaction.tags.add(*tags)
+        return transaction
+
+    def descriptions(self, query):
+        response = self.client.get(f'/api/transactions/?{query}')
+        self.assertEqual(response.status_code, 200)
+        return sorted(row['description'] for row in response.data['results'])
+
+    def tag_ids(self, transaction):
+        transaction.refresh_from_db()
+        return transaction.tag_ids
+
+    def test_filters(self):
+        self.assertEqual(self.descriptions(f'tags={self.work.pk},{self.travel.pk}'), ['taxi'])
+        self.assertEqual(self.descriptions(f'tags_any={self.work.pk},{self.food.pk}'), ['lunch', 'taxi'])
+        self.assertEqual(self.descriptions(f'tags_exclude={self.travel.pk}'), ['lunch', 'rent'])
+        self.assertEqual(
+            self.descriptions(f'tags_any={self.travel.pk}&tags_exclude={self.work.pk}'), ['train']
+        )
+        response = self.client.get('/api/transactions/?tags=work')
+        self.assertEqual(response.status_code, 400)
+
+    def test_tag_ids_follow_forward_changes(self):
+        self.assertEqual(self.tag_ids(self.taxi), sorted([self.work.pk, self.travel.pk]))
+        self.taxi.tags.remove(self.work)
+        self.assertEqual(self.tag_ids(self.taxi), [self.travel.pk])
+        self.taxi.tags.clear()
+        self.assertEqual(self.tag_ids(self.taxi), [])
+
+    def test_tag_ids_follow_reverse_changes(self):
+        self.food.transactions.add(self.rent, self.train)
+        self.assertEqual(self.tag_ids(self.rent), [self.food.pk])
+        self.assertEqual(self.tag_ids(self.train), sorted([self.travel.pk, self.food.pk]))
+        self.travel.transactions.clear()
+        self.assertEqual(self.tag_ids(self.taxi), [self.work.pk])
+        self.assertEqual(self.tag_ids(self.train), [self.food.pk])
+
+    def test_tag_delete(self):
+        self.travel.delete()
+        self.assertEqual(self.tag_ids(self.taxi), [self.work.pk])
+        self.assertEqual(self.tag_ids(self.train), [])
+        self.assertEqual(self.tag_ids(self.lunch), [self.food.pk])
+
+
+class DailyBalanceTests(TestCase):
+    """Incremental balance updates must match a full rebuild"""
+
+    # Users may be placed on any shard
+    databases = '__all__'
+    start = date(2024, 1, 1)
+    end = date(2024, 1, 31)
+
+    def setUp(self):
+        self.user = User.objects.create_user('balances', password='secret-password')
+        shard = use_user_shard(self.user.pk)
+        shard.__enter__()
+        self.addCleanup(shard.__exit__, None, None, None)
+
+    def add(self, day, transaction_type, amount, description='coffee', currency='USD'):
+        return Transaction.objects.create(
+            user=self.user,
+            amount=Decimal(amount),
+            currency=currency,
+            type=transaction_type,
+            date=date(2024, 1, day),
+            description=description,
+        )
+
+    def assertMatchesRebuild(self):
+        incremental = balance_series(self.user.pk, self.start, self.end)
+        rebuild_balances(self.user.pk)
+        self.assertEqual(incremental, balance_series(self.user.pk, self.start, self.end))
+
+    def test_create(self):
+        self.add(5, Transaction.INCOME, '100.00')
+        self.add(3, Transaction.EXPENSE, '12.50')
+        self.add(5, Transaction.EXPENSE, '7.25', 'lunch')
+        self.assertMatchesRebuild()
+
+    def test_backdated_edit(self):
+        salary = self.add(10, Transaction.INCOME, '100.00', 'salary')
+        rent = self.add(12, Transaction.EXPENSE, '40.00', 'rent')
+        salary.date = date(2024, 1, 2)
+        salary.amount = Decimal('120.00')
+        salary.save()
+        rent.type = Transaction.INCOME
+        rent.save()
+        self.assertMatchesRebuild()
+
+    def test_delete(self):
+        self.add(4, Transaction.INCOME, '50.00')
+        groceries = self.add(6, Transaction.EXPENSE, '20.00', 'groceries')
+        self.add(8, Transaction.EXPENSE, '5.00')
+        groceries.delete()
+        self.assertMatchesRebuild()
+
+    def test_bulk_ingest(self):
+        self.add(15, Transaction.INCOME, '30.00', 'refund')
+        rows = [
+            {'amount': Decimal('10.00'), 'type': Transaction.EXPENSE, 'date': date(2024, 1, 3), 'description': 'a'},
+            {'amount': Decimal('15.00'), 'type': Transaction.EXPENSE, 'date': date(2024, 1, 3), 'description': 'b'},
+            {'amount': Decimal('200.00'), 'type': Transaction.INCOME, 'date': date(2024, 1, 20), 'description': 'c'},
+        ]
+        bulk_ingest(self.user, rows)
+        # A retried upload must not count the rows twice
+        counts = bulk_ingest(self.user, rows)
+        self.assertEqual(counts['created'], 0)
+        self.assertMatchesRebuild()
+
+    def test_converted_amounts(self):
+        ExchangeRate.objects.create(currency='EUR', date=date(2024, 1, 1), rate=Decimal('1.1'))
+        # Each 5.01 EUR is 5.511 USD, counted as 5.51 both ways
+        for day in (2, 2, 2, 3, 3, 4):
+            self.add(day, Transaction.EXPENSE, '5.01', currency='EUR')
+        self.add(4, Transaction.INCOME, '0.10', currency='EUR')
+        self.assertEqual(balance_series(self.user.pk, self.end, self.end)[0], Decimal('-32.95'))
+        self.assertMatchesRebuild()
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get('/api/transactions/summary/?start_date=2024-01-01&end_date=2024-01-31')
+        self.assertEqual(
+            (response.data['total_income'], response.data['total_expenses'], response.data['balance']),
+            (0.11, 33.06, -32.95)
+        )
+
+    def test_base_currency_change(self):
+        profile = Profile.objects.create(user=self.user, base_currency='USD')
+        ExchangeRate.objects.create(currency='EUR', date=date(2024, 1, 1), rate=Decimal('1.25'))
+        self.add(2, Transaction.INCOME, '100.00')
+        self.add(3, Transaction.EXPENSE, '10.00', currency='EUR')
+        profile.base_currency = 'EUR'
+        with self.captureOnCommitCallbacks(execute=True):
+            profile.save()
+        # Already in EUR when the save returns, and later deltas add to it
+        self.assertEqual(balance_series(self.user.pk, self.end, self.end)[0], Decimal('70.00'))
+        self.add(4, Transaction.EXPENSE, '10.00', currency='EUR')
+        self.assertEqual(balance_series(self.user.pk, self.end, self.end)[0], Decimal('60.00'))
+        self.assertMatchesRebuild()
+
+    def test_delete_with_updates_suspended(self):
+        self.add(4, Transaction.INCOME, '50.00')
+        with balance_updates_suspended():
+            Transaction.objects.filter(user=self.user).delete()
+        self.assertEqual(balance_series(self.user.pk, self.end, self.end)[0], Decimal('50.00'))
+
+    def test_delete_user(self):
+        self.add(4, Transaction.INCOME, '50.00')
+        self.add(6, Transaction.EXPENSE, '20.00')
+        User.objects.filter(pk=self.user.pk).delete()
+        self.assertFalse(DailyBalance.objects.filter(user_id=self.user.pk).exists())
+
+
+class DuplicateTests(TestCase):
+    """on_conflict handling of the create and bulk endpoints, and dedupe_transactions"""
+
+    databases = '__all__'
+
+    def setUp(self):
+        self.user = User.objects.create_user('duplicates', password='secret-password')
+        shard = use_user_shard(self.user.pk)
+        shard.__enter__()
+        self.addCleanup(shard.__exit__, None, None, None)
+        self.food = Category.objects.create(user=self.user, name='Food', type=Category.EXPENSE)
+        reset_bucket_store()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def row(self, **fields):
+        return {'amount': '4.50', 'type': 'expense', 'date': '2024-01-05', 'description': 'Coffee', **fields}
+
+    def post(self, data, on_conflict=None, action=''):
+        query = f'?on_conflict={on_conflict}' if on_conflict else ''
+        return self.client.post(f'/api/transactions/{action}{query}', data, format='json')
+
+    def transactions(self):
+        return Transaction.objects.filter(user=self.user)
+
+    def test_create_on_conflict(self):
+        original = self.post(self.row()).data['id']
+        # Without on_conflict an identical transaction is a new one
+        self.assertEqual(self.post(self.row(description='  coffee ')).status_code, 201)
+        self.transactions().exclude(pk=original).delete()
+
+        response = self.post(self.row(), 'error')
+        self.assertEqual(response.status_code, 400)
+        response = self.post(self.row(category=self.food.pk), 'skip')
+        self.assertEqual((response.status_code, response.data['id'], response.data['category']), (200, original, None))
+        response = self.post(self.row(category=self.food.pk), 'update')
+        self.assertEqual((response.status_code, response.data['id'], response.data['category']), (200, original, self.food.pk))
+        self.assertEqual(self.transactions().count(), 1)
+        self.assertEqual(self.post(self.row(), 'merge').status_code, 400)
+
+    def test_bulk_on_conflict(self):
+        rows = [self.row(), self.row(), self.row(amount='3.00')]
+        response = self.post(rows, action='bulk/')
+        self.assertEqual(response.data, {'created': 3, 'updated': 0, 'skipped': 0})
+
+        response = self.post([self.row(category=self.food.pk)], action='bulk/')
+        self.assertEqual((response.status_code, response.data['skipped']), (200, 1))
+        self.assertEqual(self.transactions().filter(category=self.food).count(), 0)
+
+        response = self.post([self.row(category=self.food.pk)], 'update', 'bulk/')
+        self.assertEqual(response.data, {'created': 0, 'updated': 1, 'skipped': 0})
+        self.assertEqual(self.transactions().filter(category=self.food).count(), 1)
+        self.assertEqual(self.transactions().count(), 3)
+        self.assertEqual(self.post(rows, 'error', 'bulk/').status_code, 400)
+
+    def test_dedupe_command(self):
+        # Entered by hand first, then imported: the import made a second row
+        manual = self.post(self.row()).data['id']
+        self.post([self.row()], action='bulk/')
+        Transaction.objects.filter(pk=manual).update(fingerprint=None)
+
+        call_command('dedupe_transactions', dry_run=True, stdout=StringIO())
+        self.assertIsNone(Transaction.objects.get(pk=manual).fingerprint)
+        out = StringIO()
+        call_command('dedupe_transactions', stdout=out)
+        self.assertIn('Found 1 duplicate transactions', out.getvalue())
+        self.assertEqual(self.transactions().count(), 2)
+        self.assertIsNotNone(Transaction.objects.get(pk=manual).fingerprint)
+
+        call_command('dedupe_transactions', merge=True, stdout=StringIO())
+        self.assertEqual(list(self.transactions().values_list('pk', flat=True)), [manual])
+        # The kept row took over the import key, so retrying the upload
+        # doesn't bring the duplicate back
+        self.assertIsNotNone(Transaction.objects.get(pk=manual).import_key)
+        response = self.post([self.row()], action='bulk/')
+        self.assertEqual(response.data['created'], 0)
+        self.assertEqual(self.transactions().count(), 1)
+
+
+class SavingsGoalTests(TestCase):
+    """Input checks of the add_amount action"""
+
+    databases = '__all__'
+
+    def setUp(self):
+        self.user = User.objects.create_user('savings', password='secret-password')
+        with use_user_shard(self.user.pk):
+            self.goal = SavingsGoal.objects.create(
+                user=self.user, name='Bike', target_amount=Decimal('500.00'), current_amount=Decimal('9999999990.00')
+            )
+        reset_bucket_store()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def add_amount(self, amount):
+        return self.client.post(f'/api/savings-goals/{self.goal.pk}/add_amount/', {'amount': amount}, format='json')
+
+    def test_add_amount(self):
+        response = self.add_amount('9.99')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['current_amount'], '9999999999.99')
+
+    def test_add_amount_rejects_bad_amounts(self):
+        for amount in ('0', '-5', 'abc', 'NaN', '1e20', '0.001', None):
+            with self.subTest(amount=amount):
+                response = self.add_amount(amount)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('error', response.data)
+        # The total must still fit the column
+        self.assertEqual(self.add_amount('10.00').status_code, 400)
+        with use_user_shard(self.user.pk):
+            self.goal.refresh_from_db()
+        self.assertEqual(self.goal.current_amount, Decimal('9999999990.00'))
+
+
+class RecurrenceTests(TestCase):
+    """Occurrence dates of recurring rules"""
+
+    def rule(self, start, frequency=RecurringRule.MONTHLY, interval=1, end=None):
+        return RecurringRule(start_date=start, frequency=frequency, interval=interval, end_date=end)
+
+    def test_month_end_is_clamped(self):
+        rule = self.rule(date(2024, 1, 31))
+        self.assertEqual(
+            [nth_occurrence(rule, n) for n in range(5)],
+            [date(2024, 1, 31), date(2024, 2, 29), date(2024, 3, 31), date(2024, 4, 30), date(2024, 5, 31)]
+        )
+
+    def test_leap_day_yearly(self):
+        rule = self.rule(date(2024, 2, 29), RecurringRule.YEARLY)
+        self.assertEqual(nth_occurrence(rule, 1), date(2025, 2, 28))
+        self.assertEqual(nth_occurrence(rule, 4), date(2028, 2, 29))
+
+    def test_interval_stepping(self):
+        weekly = self.rule(date(2024, 1, 1), RecurringRule.WEEKLY, interval=2)
+        self.assertEqual(
+            list(occurrence_dates(weekly, date(2024, 1, 10), date(2024, 2, 10))),
+            [date(2024, 1, 15), date(2024, 1, 29)]
+        )
+        quarterly = self.rule(date(2024, 1, 31), interval=3)
+        self.assertEqual(
+            list(occurrence_dates(quarterly, date(2024, 5, 1), date(2024, 12, 31))),
+            [date(2024, 7, 31), date(2024, 10, 31)]
+        )
+
+    def test_range_starts_between_clamped_dates(self):
+        rule = self.rule(date(2024, 1, 31))
+        self.assertEqual(next(occurrence_dates(rule, date(2024, 2, 29), date(2024, 12, 31))), date(2024, 2, 29))
+        self.assertEqual(next(occurrence_dates(rule, date(2024, 3, 1), date(2024, 12, 31))), date(2024, 3, 31))
+
+    def test_end_date(self):
+        rule = self.rule(date(2024, 1, 1), RecurringRule.DAILY, end=date(2024, 1, 3))
+        self.assertEqual(len(list(occurrence_dates(rule, None, date(2024, 1, 10)))), 3)
+
+
+class RecurringTransactionTests(TestCase):
+    """Stored and pending occurrences of a partly materialized rule"""
+
+    databases = '__all__'
+
+    def setUp(self):
+        self.user = User.objects.create_user('recurring', password='secret-password')
+        # Route this test's queries to the user's shard, as the API does
+        shard = use_user_shard(self.user.pk)
+        shard.__enter__()
+        self.addCleanup(shard.__exit__, None, None, None)
+        self.rent = Category.objects.create(user=self.user, name='Rent', type=Category.EXPENSE)
+        self.rule = RecurringRule.objects.create(
+            user=self.user, amount=Decimal('30.00'), type=Transaction.EXPENSE,
+            description='rent', category=self.rent, start_date=date(2024, 1, 15)
+        )
+        # Jan 15 and Feb 15 are stored, later months are pending
+        materialize_due(self.user, date(2024, 2, 20))
+        self.rule.refresh_from_db()
+        Transaction.objects.create(
+            user=self.user, amount=Decimal('10.00'), type=Transaction.EXPENSE,
+            date=date(2024, 3, 1), description='keys', category=self.rent
+        )
+        reset_bucket_store()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def rules(self):
+        return RecurringRule.objects.filter(user=self.user).prefetch_related('tags')
+
+    def test_pending_starts_after_materialized_until(self):
+        self.assertEqual(self.rule.materialized_until, date(2024, 2, 20))
+        self.assertEqual(pending_from(self.rule, date(2024, 1, 1)), date(2024, 2, 21))
+        self.assertEqual(pending_from(self.rule, date(2024, 3, 1)), date(2024, 3, 1))
+        pending = pending_occurrences(self.rules(), date(2024, 1, 1), date(2024, 4, 30))
+        self.assertEqual([o.date for o in pending], [date(2024, 3, 15), date(2024, 4, 15)])
+        self.assertTrue(all(o.recurring_rule_id == self.rule.pk for o in pending))
+
+    def test_materialize_due_is_idempotent(self):
+        self.assertEqual(materialize_due(self.user, date(2024, 2, 20))['created'], 0)
+        self.assertEqual(materialize_due(self.user, date(2024, 3, 20))['created'], 1)
+        self.assertEqual(Transaction.objects.filter(user=self.user, description='rent').count(), 3)
+
+    def test_identical_rules_both_materialize(self):
+        RecurringRule.objects.create(
+            user=self.user, amount=Decimal('30.00'), type=Transaction.EXPENSE,
+            description='rent', category=self.rent, start_date=date(2024, 1, 15)
+        )
+        materialize_due(self.user, date(2024, 2, 20))
+        self.assertEqual(Transaction.objects.filter(user=self.user, description='rent').count(), 4)
+
+    def test_merged_pagination_order(self):
+        queryset = Transaction.objects.filter(user=self.user).order_by('-date', '-created_at')
+        occurrence = pending_occurrences(self.rules(), date(2024, 3, 1), date(2024, 4, 30))
+        # Another pending occurrence on a stored row's date sorts first
+        same_day = Transaction(user=self.user, amount=Decimal('1.00'), type=Transaction.EXPENSE, date=date(2024, 3, 1))
+        merged = MergedTransactions(queryset, occurrence + [same_day], ['-date', '-created_at'])
+
+        expected = [date(2024, 4, 15), date(2024, 3, 15), date(2024, 3, 1), date(2024, 3, 1), date(2024, 2, 15), date(2024, 1, 15)]
+        self.assertEqual(merged.count(), 6)
+        self.assertEqual([t.date for t in merged], expected)
+        pages = merged[0:2] + merged[2:4] + merged[4:6]
+        self.assertEqual([t.date for t in pages], expected)
+        self.assertIsNone(pages[2].pk)
+        self.assertEqual(pages[3].description, 'keys')
+
+    def test_list_includes_pending_occurrences(self):
+        response = self.client.get('/api/transactions/?start_date=2024-01-01&end_date=2024-04-30')
+        rows = response.data['results']
+        self.assertEqual(response.data['count'], 5)
+        self.assertEqual(
+            [(row['date'], row['recurring_rule']) for row in rows],
+            [
+                ('2024-04-15', self.rule.pk), ('2024-03-15', self.rule.pk),
+                ('2024-03-01', None), ('2024-02-15', None), ('2024-01-15', None),
+            ]
+        )
+        response = self.client.get('/api/transactions/?start_date=2024-01-01&end_date=2024-04-30&recurring=false')
+        self.assertEqual(response.data['count'], 3)
+
+    def test_summary_counts_each_occurrence_once(self):
+        response = self.client.get('/api/transactions/summary/?start_date=2024-01-01&end_date=2024-04-30')
+        self.assertEqual(response.data['total_expenses'], 130.0)
+        self.assertEqual(response.data['transaction_count'], 5)
+        self.assertEqual(response.data['recurring_count'], 2)
+
+    def test_budget_spent_includes_pending_occurrences(self):
+        for month in (2, 3):
+            Budget.objects.create(
+                user=self.user, category=self.rent, amount=Decimal('100.00'), year=2024, month=month
+            )
+        response = self.client.get('/api/budgets/')
+        spent = {row['month']: row['spent_amount'] for row in response.data['results']}
+        # February's occurrence is stored, March's is pending
+        self.assertEqual(spent, {2: 30.0, 3: 40.0})
+
+
+class ForecastTests(TestCase):
+    """Projections and the versioned forecast cache"""
+
+    databases = '__all__'
+    today = date(2024, 3, 16)
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('forecasts', password='secret-password')
+        shard = use_user_shard(self.user.pk)
+        shard.__enter__()
+        self.addCleanup(shard.__exit__, None, None, None)
+        self.food = Category.objects.create(user=self.user, name='Food', type=Category.EXPENSE)
+
+    def spend(self, day, amount):
+        return Transaction.objects.create(
+            user=self.user, amount=Decimal(amount), type=Transaction.EXPENSE,
+            date=day, description='groceries', category=self.food
+        )
+
+    def goal(self, name, target, current, created, deadline=None):
+        goal = SavingsGoal.objects.create(
+            user=self.user, name=name, target_amount=Decimal(target),
+            current_amount=Decimal(current), deadline=deadline
+        )
+        created_at = timezone.make_aware(datetime.combine(created, time(12)))
+        SavingsGoal.objects.filter(pk=goal.pk).update(created_at=created_at)
+        return goal
+
+    def test_project_series(self):
+        self.assertEqual(list(project_series(np.array([]), 0, 3)), [0, 0, 0])
+        # Too short for a trend: the mean
+        self.assertEqual(list(project_series(np.array([5.0, 7.0]), 0, 2)), [6, 6])
+        np.testing.assert_allclose(project_series(np.arange(10.0, 70.0, 10.0), 0, 2), [70, 80])
+        # Falling series stop at zero
+        self.assertEqual(list(project_series(np.array([30.0, 20.0, 10.0]), 0, 2)), [0, 0])
+
+    def test_project_series_seasonality(self):
+        # Three years of 100 a month with an extra 30 every December
+        january = _month_index(2021, 1)
+        values = np.array([130.0 if month % 12 == 11 else 100.0 for month in range(36)])
+        projection = project_series(values, january, 12)
+        self.assertAlmostEqual(projection[11] - projection[10], 30)
+        # Under two years the December bump is only trend
+        projection = project_series(values[12:35], january + 12, 12)
+        self.assertLess(projection[11] - projection[10], 5)
+
+    def test_forecast_budgets(self):
+        self.spend(date(2024, 1, 10), '100.00')
+        self.spend(date(2024, 3, 2), '75.00')
+        self.spend(date(2024, 3, 9), '75.00')
+        monthly = Budget.objects.create(user=self.user, category=self.food, amount=Decimal('300.00'), year=2024, month=3)
+        yearly = Budget.objects.create(
+            user=self.user, category=self.food, amount=Decimal('1000.00'), year=2024, period=Budget.YEARLY
+        )
+        Budget.objects.create(user=self.user, category=self.food, amount=Decimal('300.00'), year=2024, month=4)
+
+        current_month = _month_index(2024, 3)
+        history = load_history(self.user.pk, self.today)
+        results = {row['budget']: row for row in forecast_budgets(self.user.pk, history, self.today, current_month)}
+        self.assertEqual(set(results), {monthly.pk, yearly.pk})
+
+        # Pace so far blended with the daily rate over the previous twelve
+        # months (100 over the 366 days from March 2023 to February 2024)
+        historical_rate = 100 / 366
+        projected = 150 + 15 * (16 / 31 * 150 / 16 + 15 / 31 * historical_rate)
+        self.assertEqual(results[monthly.pk]['spent_amount'], 150)
+        self.assertEqual(results[monthly.pk]['projected_amount'], round(projected, 2))
+        self.assertEqual(results[monthly.pk]['projected_percentage'], round(projected * 100 / 300, 1))
+        self.assertFalse(results[monthly.pk]['projected_over_budget'])
+
+        # Day 76 of a leap year
+        projected = 250 + 290 * (76 / 366 * 250 / 76 + 290 / 366 * historical_rate)
+        self.assertEqual(results[yearly.pk]['spent_amount'], 250)
+        self.assertEqual(results[yearly.pk]['projected_amount'], round(projected, 2))
+        self.assertFalse(results[yearly.pk]['projected_over_budget'])
+
+    def test_forecast_savings_goals(self):
+        # 600 saved in 181 days, so the other 600 take as long again
+        paced = self.goal('Car', '1200.00', '600.00', date(2023, 9, 17), deadline=date(2024, 6, 14))
+        # Nothing saved yet: half of the projected monthly net
+        fresh = self.goal('Trip', '500.00', '0.00', self.today)
+        done = self.goal('Phone', '100.00', '100.00', date(2023, 12, 1), deadline=date(2024, 1, 1))
+
+        results = {row['goal']: row for row in forecast_savings_goals(self.user.pk, self.today, 200.0)}
+        self.assertEqual(results[paced.pk]['expected_completion'], self.today + timedelta(days=181))
+        self.assertEqual(results[paced.pk]['required_monthly_amount'], round(600 / (90 / 30.44), 2))
+        self.assertFalse(results[paced.pk]['on_track'])
+        self.assertEqual(results[fresh.pk]['monthly_rate'], 100)
+        self.assertEqual(results[fresh.pk]['expected_completion'], self.today + timedelta(days=153))
+        self.assertIsNone(results[fresh.pk]['on_track'])
+        self.assertEqual(results[done.pk]['expected_completion'], self.today)
+        self.assertFalse(results[done.pk]['on_track'])
+
+        # No savings pace and no positive cash flow: no completion date
+        results = {row['goal']: row for row in forecast_savings_goals(self.user.pk, self.today, -50.0)}
+        self.assertIsNone(results[fresh.pk]['expected_completion'])
+
+    def test_cache_follows_versions(self):
+        self.spend(date(2024, 2, 10), '20.00')
+        forecast = build_forecast(self.user.pk, today=self.today)
+        # A hit reads the stored versions, in the user's shard, and nothing else
+        with self.assertNumQueries(1, using=shard_for_user(self.user.pk)):
+            self.assertEqual(build_forecast(self.user.pk, today=self.today), forecast)
+
+        budget = Budget.objects.create(user=self.user, category=self.food, amount=Decimal('50.00'), year=2024, month=3)
+        self.assertEqual(len(build_forecast(self.user.pk, today=self.today)['budgets']), 1)
+        budget.delete()
+        self.assertEqual(build_forecast(self.user.pk, today=self.today)['budgets'], [])
+
+        bulk_ingest(self.user, [
+            {'amount': Decimal('30.00'), 'type': Transaction.EXPENSE, 'date': date(2024, 2, 12), 'description': 'a'},
+        ])
+        self.assertNotEqual(build_forecast(self.user.pk, today=self.today), forecast)
+
+        rates_before = rates_version()
+        ExchangeRate.objects.create(currency='EUR', date=date(2024, 1, 1), rate=Decimal('1.1'))
+        self.assertNotEqual(rates_version(), rates_before)
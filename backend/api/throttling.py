@@ -0,0 +1,158 @@
+"""
+Per-user token bucket throttling.
+
+Rates are configured per scope in `REST_FRAMEWORK['DEFAULT_THROTTLE_RATES']`
+using the usual DRF format (e.g. '30/min'): the number is the bucket
+capacity and the bucket refills at that many tokens per period.
+
+Buckets live in process memory by default, so throttling costs no database
+or network round trips. Set `THROTTLE_CACHE` to a `CACHES` alias to share
+buckets between processes instead.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    """Parse '<tokens>/<period>' into (capacity, tokens per second)"""
+    num, period = rate.split('/')
+    capacity = int(num)
+    return capacity, capacity / PERIODS[period[0]]
+
+
+class LocalBucketStore:
+    """In-process token buckets, evicting the least recently used keys"""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def consume(self, key, capacity, refill_rate, now):
+        """Take one token from the bucket; return seconds to wait, 0 if allowed"""
+        with self._lock:
+            tokens, last = self._buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - last) * refill_rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0
+            else:
+                wait = (1 - tokens) / refill_rate
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_entries:
+                self._buckets.popitem(last=False)
+            return wait
+
+
+class CacheBucketStore:
+    """Token buckets kept in a shared Django cache.
+
+    Updates are read-modify-write, so concurrent requests from one user on
+    different processes may occasionally both be allowed.
+    """
+
+    def __init__(self, alias):
+        self.cache = caches[alias]
+
+    def consume(self, key, capacity, refill_rate, now):
+        """Take one token from the bucket; return seconds to wait, 0 if allowed"""
+        tokens, last = self.cache.get(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - last) * refill_rate)
+        if tokens >= 1:
+            tokens -= 1
+            wait = 0
+        else:
+            wait = (1 - tokens) / refill_rate
+        # Expire once the bucket would be full again anyway
+        self.cache.set(key, (tokens, now), int(capacity / refill_rate) + 1)
+        return wait
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_bucket_store():
+    """Return the configured bucket store, creating it on first use"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                alias = getattr(settings, 'THROTTLE_CACHE', '')
+                _store = CacheBucketStore(alias) if alias else LocalBucketStore()
+    return _store
+
+
+def reset_bucket_store():
+    """Drop the bucket store, so the next request starts with full buckets.
+
+    Tests call this between cases; it also runs when THROTTLE_CACHE or
+    REST_FRAMEWORK is overridden. Buckets already in a shared cache stay.
+    """
+    global _store
+    with _store_lock:
+        _store = None
+
+
+@receiver(setting_changed)
+def throttle_settings_changed(setting, **kwargs):
+    if setting in ('THROTTLE_CACHE', 'REST_FRAMEWORK'):
+        reset_bucket_store()
+
+
+class ScopedTokenBucketThrottle(BaseThrottle):
+    """Throttle each user (or anonymous client IP) per scope with a token bucket.
+
+    The scope is taken from the view's `throttle_scopes` mapping of action
+    name to scope, falling back to `throttle_scope` and then `default_scope`.
+    The special `search` key applies to list requests with a search term.
+    """
+    default_scope = 'crud'
+    cache_format = 'throttle_%(scope)s_%(ident)s'
+
+    def __init__(self):
+        self.wait_time = 0
+
+    def get_scope(self, request, view):
+        scopes = getattr(view, 'throttle_scopes', {})
+        action = getattr(view, 'action', None)
+        if action == 'list' and 'search' in scopes and request.query_params.get(api_settings.SEARCH_PARAM):
+            return scopes['search']
+        return scopes.get(action) or getattr(view, 'throttle_scope', None) or self.default_scope
+
+    def get_rate(self, scope):
+        try:
+            return api_settings.DEFAULT_THROTTLE_RATES[scope]
+        except KeyError:
+            raise ImproperlyConfigured(f"No default throttle rate set for '{scope}' scope")
+
+    def allow_request(self, request, view):
+        scope = self.get_scope(request, view)
+        rate = self.get_rate(scope)
+        if rate is None:
+            return True
+
+        if request.user and request.user.is_authenticated:
+            ident = request.user.pk
+        else:
+            ident = f'anon_{self.get_ident(request)}'
+        key = self.cache_format % {'scope': scope, 'ident': ident}
+
+        capacity, refill_rate = parse_rate(rate)
+        self.wait_time = get_bucket_store().consume(key, capacity, refill_rate, time.time())
+        return self.wait_time == 0
+
+    def wait(self):
+        return self.wait_time
@@ -6,8 +6,11 @@ router = DefaultRouter()
 router.register(r'categories', views.CategoryViewSet, basename='category')
 router.register(r'tags', views.TagViewSet, basename='tag')
 router.register(r'transactions', views.TransactionViewSet, basename='transaction')
+router.register(r'recurring-rules', views.RecurringRuleViewSet, basename='recurringrule')
 router.register(r'budgets', views.BudgetViewSet, basename='budget')
 router.register(r'savings-goals', views.SavingsGoalViewSet, basename='savingsgoal')
+router.register(r'jobs', views.JobViewSet, basename='job')
+router.register(r'forecast', views.ForecastViewSet, basename='forecast')
 
 urlpatterns = [
     path('', include(router.urls)),
@@ -0,0 +1,41 @@
+"""
+Stored versions of cached data.
+
+Code that changes cached data calls `touch` in the same transaction, and
+readers put the tokens from `get_versions` into their cache keys, so a cache
+hit costs one indexed query however much data there is. Tokens are random
+rather than counters: they never repeat, even when a user's data moves to a
+shard with an older version row of its own.
+
+Versions live next to the data in each shard, like the rates they track.
+"""
+from uuid import uuid4
+
+from django.db import router
+
+from .models import DataVersion
+
+
+RATES = 'rates'
+
+
+def user_key(user_id):
+    """Key of the version of a user's forecast inputs"""
+    return f'user:{user_id}'
+
+
+def touch(*keys, using=None):
+    """Give each of `keys` a new version"""
+    using = using or router.db_for_write(DataVersion)
+    DataVersion.objects.using(using).bulk_create(
+        [DataVersion(key=key, token=uuid4().hex) for key in keys],
+        update_conflicts=True,
+        unique_fields=['key'],
+        update_fields=['token'],
+    )
+
+
+def get_versions(*keys):
+    """Current tokens of `keys`, in order ('' for keys never touched)"""
+    tokens = dict(DataVersion.objects.filter(key__in=keys).values_list('key', 'token'))
+    return [tokens.get(key, '') for key in keys]
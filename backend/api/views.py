@@ -1,18 +1,31 @@
-from rest_framework import viewsets, filters, status
+from rest_framework import viewsets, filters, status, mixins, serializers
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import IsAuthenticated
-from django.db.models import Sum, Q
 from django.utils import timezone
+from django.utils.dateparse import parse_date
 from datetime import datetime, timedelta
-from .models import Category, Tag, Transaction, Budget, SavingsGoal
+from decimal import Decimal
+from accounts.sharding import UserShardMixin
+from .models import Category, Tag, Transaction, RecurringRule, Budget, SavingsGoal, Job
 from .serializers import (
-    CategorySerializer, TagSerializer, TransactionSerializer,
-    BudgetSerializer, SavingsGoalSerializer
+    CategorySerializer, TagSerializer, TransactionSerializer, RecurringRuleSerializer,
+    BudgetSerializer, SavingsGoalSerializer, JobSerializer, JobListSerializer
 )
+from .jobs import enqueue
+from .balances import income_expense_totals, balance_series
+from .ingest import bulk_ingest, ON_CONFLICT_CHOICES, SKIP, UPDATE
+from .forecasting import build_forecast
+from .currency import CENTS, get_base_currency
+from .fields import has_native_arrays
+from .recurring import MergedTransactions, occurrence_totals, pending_occurrences
 
 
-class CategoryViewSet(viewsets.ModelViewSet):
+BULK_MAX_ROWS = 1000
+
+
+class CategoryViewSet(UserShardMixin, viewsets.ModelViewSet):
     """ViewSet for managing categories"""
     serializer_class = CategorySerializer
     permission_classes = [IsAuthenticated]
@@ -37,7 +50,7 @@ class CategoryViewSet(viewsets.ModelViewSet):
         serializer.save(user=self.request.user)
 
 
-class TagViewSet(viewsets.ModelViewSet):
+class TagViewSet(UserShardMixin, viewsets.ModelViewSet):
     """ViewSet for managing tags"""
     serializer_class = TagSerializer
     permission_classes = [IsAuthenticated]
@@ -55,7 +68,7 @@ class TagViewSet(viewsets.ModelViewSet):
         serializer.save(user=self.request.user)
 
 
-class TransactionViewSet(viewsets.ModelViewSet):
+class TransactionViewSet(UserShardMixin, viewsets.ModelViewSet):
     """ViewSet for managing transactions"""
     serializer_class = TransactionSerializer
     permission_classes = [IsAuthenticated]
@@ -63,6 +76,12 @@ class TransactionViewSet(viewsets.ModelViewSet):
     search_fields = ['description', 'category__name']
     ordering_fields = ['date', 'amount', 'created_at']
     ordering = ['-date', '-created_at']
+    throttle_scopes = {
+        'search': 'search',
+        'summary': 'summary',
+        'balance_history': 'summary',
+        'bulk': 'import',
+    }
     
     def get_queryset(self):
         """Return transactions for the current user"""
@@ -86,20 +105,164 @@ class TransactionViewSet(viewsets.ModelViewSet):
         if end_date:
             queryset = queryset.filter(date__lte=end_date)
         
-        return queryset.select_related('category').prefetch_related('tags')
+        # Filter by tags if provided (comma-separated ids)
+        queryset = self.filter_tags(queryset, use_tag_ids=has_native_arrays(queryset.db))
+        
+        return queryset.select_related('category')
+    
+    def filter_tags(self, queryset, use_tag_ids):
+        """Apply the tag filters: `tags` requires all, `tags_any` at least one
+        and `tags_exclude` none of the given tags.
+        
+        With `use_tag_ids` they are served by the GIN index on the
+        denormalized tag_ids array, otherwise by joins on the M2M table.
+        """
+        all_tags = self.get_tag_ids_param('tags')
+        any_tags = self.get_tag_ids_param('tags_any')
+        excluded_tags = self.get_tag_ids_param('tags_exclude')
+        
+        if use_tag_ids:
+            if all_tags:
+                queryset = queryset.filter(tag_ids__contains=all_tags)
+            if any_tags:
+                queryset = queryset.filter(tag_ids__overlap=any_tags)
+            if excluded_tags:
+                queryset = queryset.exclude(tag_ids__overlap=excluded_tags)
+            return queryset
+        
+        for tag_id in all_tags:
+            queryset = queryset.filter(tags=tag_id)
+        if any_tags:
+            queryset = queryset.filter(tags__in=any_tags).distinct()
+        if excluded_tags:
+            queryset = queryset.exclude(tags__in=excluded_tags)
+        return queryset
+    
+    def get_tag_ids_param(self, name):
+        """Parse a comma-separated list of tag ids from the query params"""
+        value = self.request.query_params.get(name, None)
+        if not value:
+            return []
+        try:
+            return [int(tag_id) for tag_id in value.split(',') if tag_id.strip()]
+        except ValueError:
+            raise ValidationError({name: 'Expected a comma-separated list of tag ids.'})
+    
+    def get_recurring_rules(self):
+        """Return the user's recurring rules matching the list filters"""
+        rules = RecurringRule.objects.filter(user=self.request.user)
+        
+        # Same type, category, tag and search filters as get_queryset
+        transaction_type = self.request.query_params.get('type', None)
+        if transaction_type:
+            rules = rules.filter(type=transaction_type)
+        category_id = self.request.query_params.get('category', None)
+        if category_id:
+            rules = rules.filter(category_id=category_id)
+        rules = self.filter_tags(rules, use_tag_ids=False)
+        rules = filters.SearchFilter().filter_queryset(self.request, rules, self)
+        
+        return rules.select_related('category').prefetch_related('tags')
+    
+    def get_date_param(self, name):
+        """Parse an ISO date from the query params"""
+        value = self.request.query_params.get(name, None)
+        if not value:
+            return None
+        try:
+            parsed = parse_date(value)
+        except ValueError:
+            parsed = None
+        if parsed is None:
+            raise ValidationError({name: 'Expected a date in YYYY-MM-DD format.'})
+        return parsed
+    
+    def list(self, request, *args, **kwargs):
+        """List transactions; with `end_date`, recurring occurrences that are not
+        stored yet are merged in (`?recurring=false` leaves them out)"""
+        queryset = self.filter_queryset(self.get_queryset())
+        
+        end_date = self.get_date_param('end_date')
+        if end_date and request.query_params.get('recurring', 'true') != 'false':
+            occurrences = pending_occurrences(
+                self.get_recurring_rules(), self.get_date_param('start_date'), end_date
+            )
+            if occurrences:
+                ordering = filters.OrderingFilter().get_ordering(request, queryset, self)
+                queryset = MergedTransactions(queryset, occurrences, ordering)
+        
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        
+        serializer = self.get_serializer(queryset, many=True)
+        return Response(serializer.data)
+    
+    def get_serializer_context(self):
+        """Pass the requested duplicate handling to the serializer"""
+        context = super().get_serializer_context()
+        default = SKIP if self.action == 'bulk' else None
+        context['on_conflict'] = self.request.query_params.get('on_conflict', default)
+        return context
+    
+    def create(self, request, *args, **kwargs):
+        """Create a transaction; `?on_conflict=error|skip|update` checks for duplicates"""
+        on_conflict = request.query_params.get('on_conflict')
+        if on_conflict not in (None, 'error') + ON_CONFLICT_CHOICES:
+            return Response(
+                {'error': 'on_conflict must be one of error, skip, update'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        duplicate = serializer.find_duplicate(serializer.validated_data) if on_conflict else None
+        if duplicate is None:
+            self.perform_create(serializer)
+            headers = self.get_success_headers(serializer.data)
+            return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
+        
+        if on_conflict == UPDATE:
+            serializer = self.get_serializer(duplicate, data=request.data)
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+            return Response(serializer.data)
+        return Response(self.get_serializer(duplicate).data)
     
     def perform_create(self, serializer):
         """Set the user when creating a transaction"""
         serializer.save(user=self.request.user)
     
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """Idempotently create many transactions (`?on_conflict=skip|update`)"""
+        on_conflict = request.query_params.get('on_conflict', SKIP)
+        if on_conflict not in ON_CONFLICT_CHOICES:
+            return Response(
+                {'error': 'on_conflict must be one of skip, update'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not isinstance(request.data, list) or len(request.data) > BULK_MAX_ROWS:
+            return Response(
+                {'error': f'Expected a list of at most {BULK_MAX_ROWS} transactions'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        serializer = self.get_serializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        counts = bulk_ingest(request.user, serializer.validated_data, on_conflict)
+        return Response(counts, status=status.HTTP_201_CREATED if counts['created'] else status.HTTP_200_OK)
+    
     @action(detail=False, methods=['get'])
     def summary(self, request):
-        """Get transaction summary (total income, total expenses, balance)"""
+        """Get transaction summary (total income, total expenses, balance),
+        including recurring occurrences that are not stored yet"""
         user = request.user
         
         # Get date range from query params or use current month
-        start_date = request.query_params.get('start_date', None)
-        end_date = request.query_params.get('end_date', None)
+        start_date = self.get_date_param('start_date')
+        end_date = self.get_date_param('end_date')
         
         if not start_date or not end_date:
             today = timezone.now().date()
@@ -115,27 +278,90 @@ class TransactionViewSet(viewsets.ModelViewSet):
             date__range=[start_date, end_date]
         )
         
-        total_income = transactions.filter(type='income').aggregate(
-            Sum('amount')
-        )['amount__sum'] or 0
-        
-        total_expenses = transactions.filter(type='expense').aggregate(
-            Sum('amount')
-        )['amount__sum'] or 0
-        
+        currency = get_base_currency(user.pk)
+        totals = income_expense_totals(transactions, currency)
+        rules = RecurringRule.objects.filter(user=user).select_related('category').prefetch_related('tags')
+        occurrences = pending_occurrences(rules, start_date, end_date)
+        scheduled = occurrence_totals(occurrences, currency)
+        total_income = (totals['total_income'] + scheduled[Transaction.INCOME]).quantize(CENTS)
+        total_expenses = (totals['total_expenses'] + scheduled[Transaction.EXPENSE]).quantize(CENTS)
         balance = total_income - total_expenses
         
         return Response({
             'start_date': start_date,
             'end_date': end_date,
+            'currency': currency,
             'total_income': float(total_income),
             'total_expenses': float(total_expenses),
             'balance': float(balance),
-            'transaction_count': transactions.count()
+            'transaction_count': totals['transaction_count'] + len(occurrences),
+            'recurring_count': len(occurrences)
+        })
+    
+    @action(detail=False, methods=['get'])
+    def balance_history(self, request):
+        """Get the daily running balance for a date window (default: last 30 days)"""
+        try:
+            end_date = parse_date(request.query_params.get('end_date', '')) or timezone.now().date()
+            start_date = parse_date(request.query_params.get('start_date', '')) or end_date - timedelta(days=29)
+        except ValueError:
+            return Response(
+                {'error': 'Invalid date'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        if start_date > end_date:
+            return Response(
+                {'error': 'start_date must not be after end_date'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if (end_date - start_date).days >= 3660:
+            return Response(
+                {'error': 'Date window must not exceed 10 years'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        opening_balance, points = balance_series(request.user.pk, start_date, end_date)
+        return Response({
+            'start_date': start_date,
+            'end_date': end_date,
+            'currency': get_base_currency(request.user.pk),
+            'opening_balance': float(opening_balance),
+            'points': points
         })
 
 
-class BudgetViewSet(viewsets.ModelViewSet):
+class RecurringRuleViewSet(UserShardMixin, viewsets.ModelViewSet):
+    """ViewSet for managing recurring transaction rules"""
+    serializer_class = RecurringRuleSerializer
+    permission_classes = [IsAuthenticated]
+    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
+    search_fields = ['description', 'category__name']
+    ordering_fields = ['start_date', 'amount', 'created_at']
+    ordering = ['start_date', 'created_at']
+    
+    def get_queryset(self):
+        """Return recurring rules for the current user"""
+        queryset = RecurringRule.objects.filter(user=self.request.user)
+        
+        # Filter by type if provided
+        rule_type = self.request.query_params.get('type', None)
+        if rule_type:
+            queryset = queryset.filter(type=rule_type)
+        
+        # Filter by frequency if provided
+        frequency = self.request.query_params.get('frequency', None)
+        if frequency:
+            queryset = queryset.filter(frequency=frequency)
+        
+        return queryset.select_related('category').prefetch_related('tags')
+    
+    def perform_create(self, serializer):
+        """Set the user when creating a recurring rule"""
+        serializer.save(user=self.request.user)
+
+
+class BudgetViewSet(UserShardMixin, viewsets.ModelViewSet):
     """ViewSet for managing budgets"""
     serializer_class = BudgetSerializer
     permission_classes = [IsAuthenticated]
@@ -164,7 +390,7 @@ class BudgetViewSet(viewsets.ModelViewSet):
         serializer.save(user=self.request.user)
 
 
-class SavingsGoalViewSet(viewsets.ModelViewSet):
+class SavingsGoalViewSet(UserShardMixin, viewsets.ModelViewSet):
     """ViewSet for managing savings goals"""
     serializer_class = SavingsGoalSerializer
     permission_classes = [IsAuthenticated]
@@ -185,23 +411,75 @@ class SavingsGoalViewSet(viewsets.ModelViewSet):
     def add_amount(self, request, pk=None):
         """Add amount to savings goal"""
         goal = self.get_object()
-        amount = request.data.get('amount', 0)
+        amount_field = serializers.DecimalField(max_digits=12, decimal_places=2, min_value=Decimal('0.01'))
+        try:
+            amount = amount_field.run_validation(request.data.get('amount'))
+        except ValidationError as exc:
+            return Response({'error': exc.detail[0]}, status=status.HTTP_400_BAD_REQUEST)
+        
+        # The new total goes through the serializer too, so it must still fit
+        # the column
+        serializer = self.get_serializer(
+            goal, data={'current_amount': goal.current_amount + amount}, partial=True
+        )
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response(serializer.data)
+
+
+class JobViewSet(UserShardMixin, mixins.CreateModelMixin, viewsets.ReadOnlyModelViewSet):
+    """ViewSet for enqueueing background jobs and polling their progress"""
+    serializer_class = JobSerializer
+    permission_classes = [IsAuthenticated]
+    filter_backends = [filters.OrderingFilter]
+    ordering_fields = ['created_at', 'finished_at']
+    ordering = ['-created_at']
+    throttle_scopes = {'create': 'export'}
+    
+    def get_serializer_class(self):
+        """Leave results out of lists; clients fetch them per job"""
+        if self.action == 'list':
+            return JobListSerializer
+        return JobSerializer
+    
+    def get_queryset(self):
+        """Return jobs for the current user"""
+        queryset = Job.objects.filter(user=self.request.user)
+        
+        # Filter by status if provided
+        job_status = self.request.query_params.get('status', None)
+        if job_status:
+            queryset = queryset.filter(status=job_status)
         
+        return queryset
+    
+    def create(self, request, *args, **kwargs):
+        """Enqueue a job for the current user"""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        job = enqueue(
+            serializer.validated_data['kind'],
+            user=request.user,
+            params=serializer.validated_data.get('params'),
+        )
+        return Response(self.get_serializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+
+class ForecastViewSet(UserShardMixin, viewsets.ViewSet):
+    """Projected cash flow, budget spend and savings-goal completion"""
+    permission_classes = [IsAuthenticated]
+    throttle_scope = 'summary'
+    
+    def list(self, request):
+        """Get forecasts for the next `months` months (3-12, default 6)"""
         try:
-            amount = float(amount)
-            if amount <= 0:
-                return Response(
-                    {'error': 'Amount must be greater than 0'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            
-            goal.current_amount += amount
-            goal.save()
-            
-            serializer = self.get_serializer(goal)
-            return Response(serializer.data)
+            months = int(request.query_params.get('months', 6))
         except (ValueError, TypeError):
+            months = 0
+        if not 3 <= months <= 12:
             return Response(
-                {'error': 'Invalid amount'},
+                {'error': 'months must be between 3 and 12'},
                 status=status.HTTP_400_BAD_REQUEST
             )
+        
+        return Response(build_forecast(request.user.pk, months=months))
@@ -39,6 +39,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     # Third party apps
     'rest_framework',
     'rest_framework_simplejwt',
@@ -83,17 +84,44 @@ WSGI_APPLICATION = 'config.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.postgresql',
-        'NAME': 'personal_finance',
-        'USER': 'apple',
-        'PASSWORD': '',
-        'HOST': 'localhost',
-        'PORT': '5432',
+# PostgreSQL by default; DATABASE_ENGINE=django.db.backends.sqlite3 runs on
+# local SQLite files instead (tests, load tests, local shard stand-ins)
+DATABASE_ENGINE = config('DATABASE_ENGINE', default='django.db.backends.postgresql')
+DATABASE_NAME = config('DATABASE_NAME', default='personal_finance')
+
+
+def database_settings(name):
+    if DATABASE_ENGINE == 'django.db.backends.sqlite3':
+        return {'ENGINE': DATABASE_ENGINE, 'NAME': BASE_DIR / f'{name}.sqlite3'}
+    return {
+        'ENGINE': DATABASE_ENGINE,
+        'NAME': name,
+        'USER': config('DATABASE_USER', default='apple'),
+        'PASSWORD': config('DATABASE_PASSWORD', default=''),
+        'HOST': config('DATABASE_HOST', default='localhost'),
+        'PORT': config('DATABASE_PORT', default='5432'),
     }
+
+
+DATABASES = {
+    'default': database_settings(DATABASE_NAME)
 }
 
+# User sharding: each user's api data lives in one of SHARD_DATABASES (see
+# accounts/sharding.py). Extra shards are databases on the same server (or
+# SQLite files) named personal_finance_<shard>.
+DATABASE_SHARDS = config(
+    'DATABASE_SHARDS',
+    default='',
+    cast=lambda v: [s.strip() for s in v.split(',') if s.strip()]
+)
+for shard in DATABASE_SHARDS:
+    DATABASES[shard] = database_settings(f'{DATABASE_NAME}_{shard}')
+
+SHARD_DATABASES = ['default'] + DATABASE_SHARDS
+
+DATABASE_ROUTERS = ['accounts.sharding.UserShardRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -150,8 +178,39 @@ REST_FRAMEWORK = {
         'rest_framework.filters.SearchFilter',
         'rest_framework.filters.OrderingFilter',
     ],
+    'DEFAULT_THROTTLE_CLASSES': [
+        'api.throttling.ScopedTokenBucketThrottle',
+    ],
+    'DEFAULT_THROTTLE_RATES': {
+        'crud': config('THROTTLE_RATE_CRUD', default='120/min'),
+        'search': config('THROTTLE_RATE_SEARCH', default='30/min'),
+        'summary': config('THROTTLE_RATE_SUMMARY', default='30/min'),
+        'export': config('THROTTLE_RATE_EXPORT', default='10/hour'),
+        'import': config('THROTTLE_RATE_IMPORT', default='10/hour'),
+        # Anonymous register/login/refresh, per client address
+        'auth': config('THROTTLE_RATE_AUTH', default='30/min'),
+    },
+    # Number of reverse proxies in front of the app, so anonymous clients are
+    # told apart by X-Forwarded-For rather than the proxy's address
+    'NUM_PROXIES': config('NUM_PROXIES', default=None, cast=lambda v: int(v) if v not in (None, '') else None),
 }
 
+# CACHES alias used to share throttle buckets between processes;
+# empty keeps them in process memory
+THROTTLE_CACHE = config('THROTTLE_CACHE', default='')
+
+# Currencies: amounts default to DEFAULT_CURRENCY; exchange rates are stored
+# against FX_PIVOT_CURRENCY (see api/currency.py and `manage.py load_fx_rates`)
+DEFAULT_CURRENCY = config('DEFAULT_CURRENCY', default='USD')
+FX_PIVOT_CURRENCY = config('FX_PIVOT_CURRENCY', default='USD')
+
+# Background jobs (see api/jobs.py and `manage.py run_jobs`)
+JOB_WORKERS = config('JOB_WORKERS', default=2, cast=int)
+JOB_POLL_INTERVAL = config('JOB_POLL_INTERVAL', default=2.0, cast=float)
+JOB_MAX_ATTEMPTS = config('JOB_MAX_ATTEMPTS', default=3, cast=int)
+JOB_RETRY_BACKOFF = config('JOB_RETRY_BACKOFF', default=30, cast=int)
+JOB_LOCK_TIMEOUT = config('JOB_LOCK_TIMEOUT', default=600, cast=int)
+
 # JWT Settings
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),